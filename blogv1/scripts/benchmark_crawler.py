@@ -0,0 +1,389 @@
+"""
+PinterestCrawler 离线基准测试
+
+不访问网络、不启动浏览器:
+- 本地HTTP服务器提供合成的pin图片 (不同尺寸/格式, 包含会被过滤的小图和极端比例的图)
+- FakeDriver 模拟搜索页, 每次滚动渲染一批pin (bulk 模式) 或返回一页搜索接口JSON (network 模式)
+- FakeGeminiBackend 代替Gemini, 延迟和失败率可配置
+
+报告 search_and_download、analyze_image_metadata 和下载/转码路径的吞吐量与各阶段延迟。
+
+用法:
+    python benchmark_crawler.py --pins 120 --download-workers 1,4,8 --gemini-latency 0.2
+    python benchmark_crawler.py --json results.json
+"""
+import os
+import io
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import pinterest_crawler as pc  # noqa: E402
+
+FORMATS = {'jpg': ('JPEG', 'image/jpeg'), 'png': ('PNG', 'image/png'), 'webp': ('WEBP', 'image/webp')}
+
+
+def make_corpus(count, seed=0):
+    """
+    生成合成图片语料: [(文件名, 宽, 高, 字节)]
+    约15%是小图, 10%是极端比例, 其余为宽 800-1400 像素的JPEG/PNG/WebP
+    低分辨率随机色块放大得到, 内容互不相同且文件大小接近真实照片
+    """
+    from PIL import Image
+
+    rnd = random.Random(seed)
+    corpus = []
+    for i in range(count):
+        kind = rnd.random()
+        if kind < 0.15:
+            width, height = rnd.choice([(236, 354), (474, 600), (600, 600)])
+        elif kind < 0.25:
+            width, height = rnd.choice([(2000, 800), (800, 2000)])
+        else:
+            width = rnd.randint(800, 1400)
+            height = int(width * rnd.uniform(1.0, 1.5))
+        ext = rnd.choices(list(FORMATS), weights=[6, 2, 2])[0]
+        small = (max(width // 32, 2), max(height // 32, 2))
+        img = Image.frombytes('RGB', small, rnd.randbytes(small[0] * small[1] * 3))
+        img = img.resize((width, height), Image.BILINEAR)
+        buffer = io.BytesIO()
+        img.save(buffer, FORMATS[ext][0], quality=90)
+        corpus.append((f"{i}.{ext}", width, height, buffer.getvalue()))
+    return corpus
+
+
+class _QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # 尺寸探测后客户端会主动断开连接, 不输出堆栈
+        pass
+
+
+class CorpusServer:
+    """
+    本地HTTP服务器 (keep-alive), 按文件名返回语料中的图片, 可模拟每个请求的延迟
+    """
+
+    def __init__(self, corpus, latency=0.0):
+        files = {name: data for name, _, _, data in corpus}
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                name = self.path.split('?')[0].rsplit('/', 1)[-1]
+                data = files.get(name)
+                if latency:
+                    time.sleep(latency)
+                if data is None:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', FORMATS[name.rsplit('.', 1)[-1]][1])
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = _QuietHTTPServer(('127.0.0.1', 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}/img/"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FakeDriver:
+    """
+    模拟Pinterest搜索页的WebDriver替身, 只实现爬虫用到的方法
+    每次滚动新渲染 per_scroll 个pin; bulk 模式通过 COLLECT_PINS_JS 返回,
+    network 模式通过性能日志和 Network.getResponseBody 返回搜索接口JSON
+    """
+
+    def __init__(self, corpus, base_url, per_scroll=25):
+        self.corpus = corpus
+        self.base_url = base_url
+        self.per_scroll = per_scroll
+        self.rendered = 0
+        self.returned = 0
+        self._logs = []
+        self._bodies = {}
+
+    def get(self, url):
+        self.rendered = 0
+        self.returned = 0
+        self._render()
+
+    def _render(self):
+        start, self.rendered = self.rendered, min(self.rendered + self.per_scroll, len(self.corpus))
+        if start == self.rendered:
+            return
+        request_id = f"req-{start}"
+        self._bodies[request_id] = {
+            'resource_response': {'data': {'results': [self._pin_json(i) for i in range(start, self.rendered)]}}
+        }
+        for method, params in (
+            ('Network.responseReceived', {
+                'requestId': request_id,
+                'response': {'url': 'https://www.pinterest.com/resource/BaseSearchResource/get/'}
+            }),
+            ('Network.loadingFinished', {'requestId': request_id}),
+        ):
+            self._logs.append({'message': json.dumps({'message': {'method': method, 'params': params}})})
+
+    def _pin_json(self, i):
+        name, width, height, _ = self.corpus[i]
+        return {
+            'id': str(i),
+            'description': f'synthetic pin {i}',
+            'images': {'orig': {'url': self.base_url + name, 'width': width, 'height': height}}
+        }
+
+    def execute_script(self, script, *args):
+        if script == pc.COLLECT_PINS_JS:
+            pins = [
+                {'id': str(i), 'src': self.base_url + self.corpus[i][0],
+                 'srcset': f"{self.base_url}{self.corpus[i][0]} 736w"}
+                for i in range(self.returned, self.rendered)
+            ]
+            self.returned = self.rendered
+            return pins
+        if script == pc.INITIAL_DATA_JS:
+            return None
+        if script.startswith('window.scrollTo'):
+            self._render()
+            return None
+        if script == 'return document.body.scrollHeight':
+            return self.rendered * 100
+        return None
+
+    def get_log(self, log_type):
+        logs, self._logs = self._logs, []
+        return logs
+
+    def execute_cdp_cmd(self, cmd, params):
+        return {'body': json.dumps(self._bodies.pop(params['requestId'])), 'base64Encoded': False}
+
+    def get_cookies(self):
+        return []
+
+    def quit(self):
+        pass
+
+
+def make_crawler(base_dir, **kwargs):
+    """
+    创建不启动浏览器的爬虫 (driver在第一次使用前替换为FakeDriver)
+    """
+    options = dict(
+        base_dir=base_dir,
+        state_dir=os.path.join(base_dir, 'state'),
+        gemini_requests_per_minute=None,
+        session_file=None,
+        metrics_file=None,
+        metrics_interval=None,
+        page_load_wait=0,
+        scroll_delay=(0, 0),
+    )
+    options.update(kwargs)
+    return pc.PinterestCrawler('benchmark@example.com', 'benchmark', **options)
+
+
+def stage_table(snapshot):
+    return {
+        stage: {key: info[key] for key in ('count', 'mean_seconds', 'p50_seconds', 'p95_seconds')}
+        for stage, info in snapshot['stages'].items()
+    }
+
+
+def bench_search_and_download(corpus, server, args):
+    """
+    对每组下载线程数运行一次完整的 search_and_download (每次使用新的输出目录)
+    """
+    results = []
+    for workers in args.download_workers:
+        base_dir = tempfile.mkdtemp(prefix='pinterest-bench-')
+        try:
+            backend = pc.FakeGeminiBackend(args.gemini_latency, args.gemini_failure_rate, args.seed)
+            crawler = make_crawler(
+                base_dir,
+                download_workers=workers,
+                analysis_workers=args.analysis_workers,
+                image_workers=args.image_workers,
+                harvest_mode=args.harvest_mode,
+                gemini_backend=backend,
+            )
+            crawler.driver = FakeDriver(corpus, server.base_url, args.per_scroll)
+            started = time.perf_counter()
+            crawler.search_and_download('benchmark', max_images=args.max_images)
+            elapsed = time.perf_counter() - started
+            crawler._shutdown_image_executor()
+            snapshot = crawler.metrics.snapshot()
+            downloaded = snapshot['counters'].get('downloaded', 0)
+            results.append({
+                'download_workers': workers,
+                'seconds': round(elapsed, 3),
+                'downloaded': downloaded,
+                'analyzed': snapshot['counters'].get('analyzed', 0),
+                'images_per_minute': round(downloaded * 60.0 / elapsed, 1),
+                'gemini_calls': backend.calls,
+                'counters': snapshot['counters'],
+                'stages': stage_table(snapshot),
+            })
+        finally:
+            shutil.rmtree(base_dir, ignore_errors=True)
+    return results
+
+
+def bench_download_path(corpus, server, args):
+    """
+    逐张调用 _download_and_save (不经过队列和分析), 测量下载/探测/转码路径
+    """
+    base_dir = tempfile.mkdtemp(prefix='pinterest-bench-')
+    try:
+        crawler = make_crawler(base_dir, image_workers=args.image_workers, dedup_db=None, near_dup_distance=None)
+        save_dir = os.path.join(crawler.save_dir, 'download')
+        os.makedirs(save_dir)
+        progress = pc._CrawlProgress(len(corpus), len(corpus))
+        started = time.perf_counter()
+        for name, _, _, _ in corpus:
+            crawler._download_and_save(server.base_url + name, save_dir, 'download', progress)
+        elapsed = time.perf_counter() - started
+        crawler._shutdown_image_executor()
+        snapshot = crawler.metrics.snapshot()
+        return {
+            'images': len(corpus),
+            'seconds': round(elapsed, 3),
+            'ms_per_image': round(elapsed * 1000 / len(corpus), 2),
+            'counters': snapshot['counters'],
+            'stages': stage_table(snapshot),
+        }
+    finally:
+        shutil.rmtree(base_dir, ignore_errors=True)
+
+
+def bench_metadata(args):
+    """
+    analyze_image_metadata (逐条) 与 analyze_metadata_batch (批量) 的吞吐量
+    """
+    rnd = random.Random(args.seed)
+    words = [
+        keyword
+        for table in (pc.GENDER_KEYWORDS, pc.AGE_GROUP_KEYWORDS, *pc.TAG_KEYWORDS.values())
+        for keywords in table.values()
+        for keyword in keywords
+    ] + ['the', 'outfit', 'look', 'with', 'and', 'new', 'ideas']
+    descriptions = [
+        ' '.join(rnd.choice(words) for _ in range(rnd.randint(3, 20)))
+        for _ in range(args.descriptions)
+    ]
+    base_dir = tempfile.mkdtemp(prefix='pinterest-bench-')
+    try:
+        crawler = make_crawler(base_dir, dedup_db=None, analysis_cache_db=None, checkpoint_db=None)
+        # 预热: 编译关键词匹配器、导入numpy, 不计入耗时
+        crawler.analyze_metadata_batch(descriptions[:10])
+
+        started = time.perf_counter()
+        for description in descriptions:
+            crawler.analyze_image_metadata(description)
+        single = time.perf_counter() - started
+
+        started = time.perf_counter()
+        crawler.analyze_metadata_batch(descriptions)
+        batch = time.perf_counter() - started
+    finally:
+        shutil.rmtree(base_dir, ignore_errors=True)
+
+    return {
+        'descriptions': len(descriptions),
+        'single_us_per_description': round(single * 1e6 / len(descriptions), 2),
+        'batch_us_per_description': round(batch * 1e6 / len(descriptions), 2),
+    }
+
+
+def print_stages(stages, indent='    '):
+    for stage, info in stages.items():
+        print(
+            f"{indent}{stage:<16} {info['count']:>6}x  mean {info['mean_seconds'] * 1000:8.2f} ms"
+            f"  p50 {info['p50_seconds'] * 1000:8.2f} ms  p95 {info['p95_seconds'] * 1000:8.2f} ms"
+        )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='PinterestCrawler 离线基准测试')
+    parser.add_argument('--pins', type=int, default=120, help='合成语料的图片数量')
+    parser.add_argument('--max-images', type=int, default=60, help='search_and_download 的 max_images')
+    parser.add_argument('--download-workers', default='1,4,8', help='逗号分隔的下载线程数, 每个值运行一次')
+    parser.add_argument('--analysis-workers', type=int, default=4)
+    parser.add_argument('--image-workers', type=int, default=0, help='转码进程数, 0表示在下载线程中处理')
+    parser.add_argument('--harvest-mode', choices=['bulk', 'network'], default='bulk')
+    parser.add_argument('--per-scroll', type=int, default=25, help='每次滚动新渲染的pin数量')
+    parser.add_argument('--server-latency', type=float, default=0.0, help='本地服务器每个请求的延迟 (秒)')
+    parser.add_argument('--gemini-latency', type=float, default=0.05, help='FakeGeminiBackend 每次调用的延迟 (秒)')
+    parser.add_argument('--gemini-failure-rate', type=float, default=0.0, help='FakeGeminiBackend 返回429/503的概率')
+    parser.add_argument('--descriptions', type=int, default=20000, help='元数据标签基准的描述数量')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='把结果写入该JSON文件')
+    args = parser.parse_args(argv)
+    args.download_workers = [int(value) for value in args.download_workers.split(',') if value]
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    print(f"Generating {args.pins} synthetic pins...")
+    corpus = make_corpus(args.pins, args.seed)
+    results = {'config': {key: value for key, value in vars(args).items() if key != 'json'}}
+
+    with CorpusServer(corpus, args.server_latency) as server:
+        print('\nsearch_and_download')
+        results['search_and_download'] = bench_search_and_download(corpus, server, args)
+        for run in results['search_and_download']:
+            print(
+                f"  download_workers={run['download_workers']}: {run['seconds']:.2f}s, "
+                f"{run['downloaded']} downloaded, {run['analyzed']} analyzed, "
+                f"{run['images_per_minute']:.1f} images/min"
+            )
+            print_stages(run['stages'])
+
+        print('\ndownload/transcode path')
+        download = results['download_path'] = bench_download_path(corpus, server, args)
+        print(f"  {download['images']} images in {download['seconds']:.2f}s ({download['ms_per_image']:.2f} ms/image)")
+        print_stages(download['stages'])
+
+    print('\nanalyze_image_metadata')
+    metadata = results['metadata'] = bench_metadata(args)
+    print(
+        f"  {metadata['descriptions']} descriptions: {metadata['single_us_per_description']:.1f} us each, "
+        f"batch {metadata['batch_us_per_description']:.1f} us each"
+    )
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\nResults written to {args.json}")
+    return results
+
+
+if __name__ == '__main__':
+    main()
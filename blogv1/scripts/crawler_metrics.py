@@ -0,0 +1,224 @@
+"""
+爬取过程的计数器和各阶段耗时直方图
+"""
+import os
+import json
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+
+# 各阶段耗时直方图的桶上界 (秒), 分位数在桶内插值, 桶越密估计越准
+METRIC_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.0075, 0.01, 0.015, 0.025, 0.035, 0.05, 0.075,
+    0.1, 0.15, 0.25, 0.35, 0.5, 0.75, 1.0, 1.5, 2.5, 3.5, 5.0, 7.5, 10.0, 15.0, 30.0, 60.0
+)
+
+
+class CrawlMetrics:
+    """
+    爬取过程的计数器和各阶段耗时直方图 (线程安全)
+
+    - incr(name, n): 计数器, 例如 downloaded / skipped_small / http_errors / processing_errors / bytes_downloaded
+    - timer(stage): 上下文管理器, 把代码块的耗时记入该阶段的直方图
+    运行中定期输出一行摘要, 结束时导出为JSON或Prometheus文本格式。
+    """
+
+    def __init__(self, buckets=METRIC_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._stages = {}
+        self._reporter = None
+        self._stop_event = None
+
+    def incr(self, name, n=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def observe(self, stage, seconds):
+        """
+        记录一次阶段耗时
+        """
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            hist = self._stages.get(stage)
+            if hist is None:
+                hist = self._stages[stage] = {
+                    'count': 0, 'sum': 0.0, 'min': seconds, 'max': 0.0, 'buckets': [0] * (len(self.buckets) + 1)
+                }
+            hist['count'] += 1
+            hist['sum'] += seconds
+            hist['min'] = min(hist['min'], seconds)
+            hist['max'] = max(hist['max'], seconds)
+            hist['buckets'][index] += 1
+
+    def reset(self):
+        """
+        清空计数器和直方图, 从现在开始计时 (每次 crawl() 开始时调用)
+        """
+        with self._lock:
+            self.started_at = time.time()
+            self._counters = {}
+            self._stages = {}
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def counter(self, name):
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def state(self):
+        """
+        原始数据的副本 (可pickle), 用于在进程间汇总
+        """
+        with self._lock:
+            return {
+                'started_at': self.started_at,
+                'counters': dict(self._counters),
+                'stages': {
+                    stage: dict(hist, buckets=list(hist['buckets']))
+                    for stage, hist in self._stages.items()
+                }
+            }
+
+    def merge(self, state):
+        """
+        合并另一个 CrawlMetrics 的 state() (分片爬取时汇总子进程的指标)
+        """
+        with self._lock:
+            self.started_at = min(self.started_at, state['started_at'])
+            for name, value in state['counters'].items():
+                self._counters[name] = self._counters.get(name, 0) + value
+            for stage, other in state['stages'].items():
+                hist = self._stages.get(stage)
+                if hist is None:
+                    self._stages[stage] = dict(other, buckets=list(other['buckets']))
+                    continue
+                hist['count'] += other['count']
+                hist['sum'] += other['sum']
+                hist['min'] = min(hist['min'], other['min'])
+                hist['max'] = max(hist['max'], other['max'])
+                hist['buckets'] = [a + b for a, b in zip(hist['buckets'], other['buckets'])]
+
+    def _quantile(self, hist, q):
+        """
+        由直方图估计分位数: 在分位数所在的桶内线性插值 (同 Prometheus 的 histogram_quantile),
+        桶的上下界分别不超过实际观测到的最大值/最小值
+        """
+        if not hist['count']:
+            return 0.0
+        target = q * hist['count']
+        cumulative = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets + (float('inf'),), hist['buckets']):
+            if count and cumulative + count >= target:
+                low = max(lower, hist['min'])
+                high = min(bound, hist['max'])
+                return low + (high - low) * (target - cumulative) / count
+            cumulative += count
+            lower = bound
+        return hist['max']
+
+    def snapshot(self):
+        """
+        当前指标的汇总: 计数器、各阶段耗时 (次数/总计/平均/p50/p95/最大) 和吞吐量
+        """
+        state = self.state()
+        elapsed = max(time.time() - state['started_at'], 1e-9)
+        stages = {}
+        for stage, hist in sorted(state['stages'].items()):
+            stages[stage] = {
+                'count': hist['count'],
+                'total_seconds': round(hist['sum'], 6),
+                'mean_seconds': round(hist['sum'] / hist['count'], 6) if hist['count'] else 0.0,
+                'p50_seconds': round(self._quantile(hist, 0.5), 6),
+                'p95_seconds': round(self._quantile(hist, 0.95), 6),
+                'max_seconds': round(hist['max'], 6),
+            }
+        counters = dict(sorted(state['counters'].items()))
+        return {
+            'elapsed_seconds': round(elapsed, 3),
+            'images_per_minute': round(counters.get('downloaded', 0) * 60.0 / elapsed, 3),
+            'counters': counters,
+            'stages': stages,
+        }
+
+    def summary(self):
+        """
+        一行文字摘要, 用于定期日志
+        """
+        snapshot = self.snapshot()
+        counters = snapshot['counters']
+        stages = ', '.join(
+            f"{stage} {info['count']}x p50 {info['p50_seconds']:.3f}s"
+            for stage, info in snapshot['stages'].items()
+        )
+        return (
+            f"{counters.get('downloaded', 0)} downloaded, {counters.get('analyzed', 0)} analyzed, "
+            f"{snapshot['images_per_minute']:.1f} images/min, "
+            f"{counters.get('bytes_downloaded', 0) / 1048576:.1f} MiB; {stages}"
+        )
+
+    def to_prometheus(self, prefix='pinterest_crawler'):
+        """
+        Prometheus文本格式: 计数器为 <prefix>_<name>_total, 阶段耗时为 <prefix>_stage_seconds 直方图
+        """
+        state = self.state()
+        lines = []
+        for name, value in sorted(state['counters'].items()):
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {value}")
+        if state['stages']:
+            lines.append(f"# TYPE {prefix}_stage_seconds histogram")
+        for stage, hist in sorted(state['stages'].items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, hist['buckets']):
+                cumulative += count
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {hist["count"]}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {hist["sum"]}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {hist["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path):
+        """
+        写入文件: .prom 后缀为Prometheus文本格式, 其他为JSON
+        """
+        if path.endswith('.prom'):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.snapshot(), ensure_ascii=False, indent=2)
+        tmp_path = path + '.part'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def start_reporting(self, interval, logger):
+        """
+        在后台线程中每隔interval秒输出一次摘要
+        """
+        if not interval or self._reporter is not None:
+            return
+        self._stop_event = threading.Event()
+
+        def report():
+            while not self._stop_event.wait(interval):
+                logger.info(f"Crawl metrics: {self.summary()}")
+
+        self._reporter = threading.Thread(target=report, daemon=True)
+        self._reporter.start()
+
+    def stop_reporting(self):
+        if self._reporter is not None:
+            self._stop_event.set()
+            self._reporter.join()
+            self._reporter = None
@@ -0,0 +1,418 @@
+"""
+爬虫的SQLite状态文件: 去重索引、内容寻址图片存储的清单、Gemini分析缓存和断点续爬检查点
+"""
+import os
+import re
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from urllib.parse import urlsplit
+
+
+class _SqliteStore:
+    """
+    SQLite状态文件的公共部分
+
+    一个连接在线程间共享 (用锁串行化), autocommit + WAL, 多个分片进程可以同时读写同一个文件。
+    子类在 SCHEMA 中列出建表语句。
+    """
+
+    SCHEMA = ()
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        for statement in self.SCHEMA:
+            self._conn.execute(statement)
+
+    def _execute(self, sql, params=()):
+        """
+        执行一条语句, 返回所有结果行
+        """
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _fetchone(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchone()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def normalize_pin_url(url):
+    """
+    归一化Pinterest图片URL, 同一张图片的不同尺寸版本得到相同的键
+    例如 https://i.pinimg.com/736x/ab/cd/ef.jpg?x=1 -> i.pinimg.com/ab/cd/ef
+    """
+    parts = urlsplit(url)
+    path = re.sub(r'^/(?:originals|\d+x\d*)/', '/', parts.path)
+    path = os.path.splitext(path)[0]
+    return f"{parts.netloc.lower()}{path}"
+
+
+class DedupIndex(_SqliteStore):
+    """
+    跨查询、跨运行的去重索引 (SQLite)
+
+    - urls: 归一化后的图片URL -> 内容sha256 (下载前检查, 尺寸不合格的URL也会记录)
+    - contents: 内容sha256 -> 保存路径 / 查询词 / 是否已分析 (分析前检查)
+    - phashes: 内容sha256 -> 感知哈希, 启动时载入 PerceptualHashIndex
+    两张表都以主键查询, 语料增长到百万级时查找开销基本不变。
+    """
+
+    # 登记后超过这么多秒仍没有保存路径的内容视为进程中途退出留下的, 可以重新登记
+    STALE_CLAIM_SECONDS = 300
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS urls ('
+        ' url_key TEXT PRIMARY KEY, sha256 TEXT, created_at REAL'
+        ') WITHOUT ROWID',
+        'CREATE TABLE IF NOT EXISTS contents ('
+        ' sha256 TEXT PRIMARY KEY, image_path TEXT, query TEXT,'
+        ' analyzed INTEGER NOT NULL DEFAULT 0, created_at REAL'
+        ') WITHOUT ROWID',
+        'CREATE TABLE IF NOT EXISTS phashes ('
+        ' sha256 TEXT PRIMARY KEY, phash INTEGER NOT NULL, created_at REAL'
+        ') WITHOUT ROWID',
+    )
+
+    def __init__(self, path):
+        super().__init__(path)
+        # 旧版本的phashes表没有created_at列
+        columns = [row[1] for row in self._execute('PRAGMA table_info(phashes)')]
+        if 'created_at' not in columns:
+            self._execute('ALTER TABLE phashes ADD COLUMN created_at REAL')
+        self._execute('CREATE INDEX IF NOT EXISTS phashes_created_at ON phashes (created_at)')
+
+    def url_content(self, url):
+        """
+        :return: (URL是否已记录, 内容sha256); 尺寸不合格等未保存的URL sha256为None
+        """
+        row = self._fetchone('SELECT sha256 FROM urls WHERE url_key = ?', (normalize_pin_url(url),))
+        return (True, row[0]) if row else (False, None)
+
+    def add_url(self, url, sha256=None):
+        self._execute(
+            'INSERT OR REPLACE INTO urls (url_key, sha256, created_at) VALUES (?, ?, ?)',
+            (normalize_pin_url(url), sha256, time.time())
+        )
+
+    def claim_content(self, sha256):
+        """
+        登记一个内容哈希, 已存在时返回False
+        (image_path 仍为空且已超过 STALE_CLAIM_SECONDS 的旧登记会被接管)
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                'INSERT INTO contents (sha256, created_at) VALUES (?, ?)'
+                ' ON CONFLICT (sha256) DO UPDATE SET created_at = excluded.created_at'
+                ' WHERE contents.image_path IS NULL AND contents.created_at < ?',
+                (sha256, now, now - self.STALE_CLAIM_SECONDS)
+            )
+            return cursor.rowcount == 1
+
+    def release_content(self, sha256):
+        """
+        撤销一个尚未保存成功的登记
+        """
+        self._execute('DELETE FROM contents WHERE sha256 = ? AND image_path IS NULL', (sha256,))
+
+    def set_content_path(self, sha256, image_path, query=None):
+        self._execute(
+            'UPDATE contents SET image_path = ?, query = ? WHERE sha256 = ?',
+            (image_path, query, sha256)
+        )
+
+    def content_path(self, sha256):
+        row = self._fetchone('SELECT image_path FROM contents WHERE sha256 = ?', (sha256,))
+        return row[0] if row else None
+
+    def is_analyzed(self, sha256):
+        row = self._fetchone('SELECT analyzed FROM contents WHERE sha256 = ?', (sha256,))
+        return bool(row and row[0])
+
+    def mark_analyzed(self, sha256):
+        self._execute('UPDATE contents SET analyzed = 1 WHERE sha256 = ?', (sha256,))
+
+    def set_phash(self, sha256, phash):
+        # SQLite的INTEGER是有符号64位
+        signed = phash - (1 << 64) if phash >= 1 << 63 else phash
+        self._execute(
+            'INSERT OR REPLACE INTO phashes (sha256, phash, created_at) VALUES (?, ?, ?)',
+            (sha256, signed, time.time())
+        )
+
+    def iter_phashes(self, since=None):
+        """
+        :param since: 只返回该时间戳之后保存的哈希, None表示全部
+        """
+        if since is None:
+            rows = self._execute('SELECT sha256, phash FROM phashes')
+        else:
+            rows = self._execute('SELECT sha256, phash FROM phashes WHERE created_at >= ?', (since,))
+        for sha256, signed in rows:
+            yield sha256, signed & ((1 << 64) - 1)
+
+
+class ImageStore(_SqliteStore):
+    """
+    内容寻址的图片存储
+
+    - 图片按保存文件的sha256存放在 <root>/ab/cd/<sha256>.jpg, 每个目录下的文件数有限,
+      同一张图片只存一份, 不同运行之间不会重名
+    - manifest (SQLite) 记录每个查询包含哪些图片 (image_id = sha256) 及其顺序
+    写入都先写到 <root>/tmp 下的临时文件, 再原子地改名到最终位置。
+    """
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS manifest ('
+        ' query TEXT NOT NULL, image_id TEXT NOT NULL, position INTEGER, source_url TEXT, added_at REAL,'
+        ' PRIMARY KEY (query, image_id)'
+        ') WITHOUT ROWID',
+    )
+
+    def __init__(self, root, manifest_path):
+        self.root = root
+        self.tmp_dir = os.path.join(root, 'tmp')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        super().__init__(manifest_path)
+
+    def path_for(self, image_id, ext='.jpg'):
+        return os.path.join(self.root, image_id[:2], image_id[2:4], image_id + ext)
+
+    def image_id(self, path):
+        """
+        存储中的文件路径 -> image_id; 不在存储中的路径 (例如旧的 pin_<n>.jpg) 返回None
+        """
+        if not path or os.path.dirname(os.path.dirname(os.path.dirname(path))) != self.root:
+            return None
+        return os.path.splitext(os.path.basename(path))[0]
+
+    def put(self, tmp_path, image_id):
+        """
+        把写好的临时文件原子地移动到内容地址; 已存在相同内容时删除临时文件
+        :return: 最终路径
+        """
+        path = self.path_for(image_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, path)
+        return path
+
+    def add(self, query, image_id, source_url=None, position=None):
+        """
+        把图片加入查询的清单 (已存在时忽略)
+        """
+        self._execute(
+            'INSERT OR IGNORE INTO manifest (query, image_id, position, source_url, added_at) VALUES (?, ?, ?, ?, ?)',
+            (query, image_id, position, source_url, time.time())
+        )
+
+    def next_position(self, query):
+        rows = self._execute('SELECT MAX(position) FROM manifest WHERE query = ?', (query,))
+        return 0 if rows[0][0] is None else rows[0][0] + 1
+
+    def images(self, query):
+        """
+        查询清单中的image_id, 按加入顺序
+        """
+        rows = self._execute('SELECT image_id FROM manifest WHERE query = ? ORDER BY position, added_at', (query,))
+        return [row[0] for row in rows]
+
+    def export(self, path):
+        """
+        把清单导出为JSON {查询: [相对root的图片路径]}, 先写临时文件再改名
+        (临时文件名带进程号和随机后缀, 多个进程同时导出时互不干扰)
+        """
+        manifest = {}
+        for query, image_id in self._execute('SELECT query, image_id FROM manifest ORDER BY query, position, added_at'):
+            manifest.setdefault(query, []).append(os.path.relpath(self.path_for(image_id), self.root))
+        tmp_path = os.path.join(
+            os.path.dirname(path), f".{os.path.basename(path)}.{os.getpid()}.{uuid.uuid4().hex[:8]}.part"
+        )
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+
+class AnalysisCache(_SqliteStore):
+    """
+    Gemini分析结果的持久化缓存 (SQLite)
+
+    以 (图片内容sha256, 提示词版本) 为键。超过 max_age_days 的条目过期,
+    条目数超过 max_entries 时按最近使用时间淘汰最旧的条目。
+    """
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS analyses ('
+        ' content_hash TEXT NOT NULL, prompt_version TEXT NOT NULL, result TEXT NOT NULL,'
+        ' created_at REAL NOT NULL, last_used_at REAL NOT NULL,'
+        ' PRIMARY KEY (content_hash, prompt_version)'
+        ') WITHOUT ROWID',
+        'CREATE INDEX IF NOT EXISTS analyses_last_used ON analyses (last_used_at)',
+    )
+
+    def __init__(self, path, max_entries=200000, max_age_days=None):
+        super().__init__(path)
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self.evict()
+
+    def get(self, content_hash, prompt_version):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT result FROM analyses WHERE content_hash = ? AND prompt_version = ?',
+                (content_hash, prompt_version)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute(
+                'UPDATE analyses SET last_used_at = ? WHERE content_hash = ? AND prompt_version = ?',
+                (time.time(), content_hash, prompt_version)
+            )
+        return json.loads(row[0])
+
+    def put(self, content_hash, prompt_version, result):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO analyses'
+                ' (content_hash, prompt_version, result, created_at, last_used_at) VALUES (?, ?, ?, ?, ?)',
+                (content_hash, prompt_version, json.dumps(result, ensure_ascii=False), now, now)
+            )
+            self._puts += 1
+            evict = self._puts % 1000 == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """
+        删除过期条目, 并把条目数控制在 max_entries 以内
+        """
+        with self._lock:
+            if self.max_age_days is not None:
+                cutoff = time.time() - self.max_age_days * 86400
+                self._conn.execute('DELETE FROM analyses WHERE created_at < ?', (cutoff,))
+            if self.max_entries is not None:
+                count = self._conn.execute('SELECT COUNT(*) FROM analyses').fetchone()[0]
+                if count > self.max_entries:
+                    self._conn.execute(
+                        'DELETE FROM analyses WHERE (content_hash, prompt_version) IN ('
+                        ' SELECT content_hash, prompt_version FROM analyses ORDER BY last_used_at LIMIT ?'
+                        ')',
+                        (count - self.max_entries,)
+                    )
+
+    def invalidate(self, keep_version=None):
+        """
+        删除缓存; 指定 keep_version 时只保留该提示词版本的结果
+        """
+        with self._lock:
+            if keep_version is None:
+                self._conn.execute('DELETE FROM analyses')
+            else:
+                self._conn.execute('DELETE FROM analyses WHERE prompt_version != ?', (keep_version,))
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute('SELECT COUNT(*) FROM analyses').fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries}
+
+
+class CrawlCheckpoint(_SqliteStore):
+    """
+    断点续爬的检查点 (SQLite)
+
+    - queries: 每个查询的状态 (running/done) 和已下载数量
+    - pins: 每个查询已处理的图片URL, 以及完成到哪个阶段 (downloaded/analyzed)
+    每次状态变化立即写入, 进程崩溃或 Ctrl-C 后下一次运行可以接着做。
+    """
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS queries ('
+        ' query TEXT PRIMARY KEY, status TEXT NOT NULL, downloaded INTEGER NOT NULL DEFAULT 0,'
+        ' updated_at REAL'
+        ') WITHOUT ROWID',
+        'CREATE TABLE IF NOT EXISTS pins ('
+        ' query TEXT NOT NULL, url_key TEXT NOT NULL, image_path TEXT, digest TEXT,'
+        ' stage TEXT NOT NULL, updated_at REAL,'
+        ' PRIMARY KEY (query, url_key)'
+        ') WITHOUT ROWID',
+    )
+
+    def query_status(self, query):
+        """
+        返回 (状态, 已下载数量), 没有记录时返回 (None, 0)
+        """
+        rows = self._execute('SELECT status, downloaded FROM queries WHERE query = ?', (query,))
+        return rows[0] if rows else (None, 0)
+
+    def start_query(self, query, resume):
+        """
+        开始处理一个查询; resume=False 时清除该查询之前的进度
+        """
+        with self._lock:
+            if not resume:
+                self._conn.execute('DELETE FROM pins WHERE query = ?', (query,))
+                self._conn.execute('DELETE FROM queries WHERE query = ?', (query,))
+            self._conn.execute(
+                'INSERT INTO queries (query, status, updated_at) VALUES (?, ?, ?)'
+                ' ON CONFLICT (query) DO UPDATE SET status = excluded.status, updated_at = excluded.updated_at',
+                (query, 'running', time.time())
+            )
+
+    def finish_query(self, query):
+        self._execute(
+            'UPDATE queries SET status = ?, updated_at = ? WHERE query = ?',
+            ('done', time.time(), query)
+        )
+
+    def has_pin(self, query, url):
+        rows = self._execute(
+            'SELECT 1 FROM pins WHERE query = ? AND url_key = ?',
+            (query, normalize_pin_url(url))
+        )
+        return bool(rows)
+
+    def record_download(self, query, url, image_path, digest):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO pins (query, url_key, image_path, digest, stage, updated_at)'
+                ' VALUES (?, ?, ?, ?, ?, ?)',
+                (query, normalize_pin_url(url), image_path, digest, 'downloaded', now)
+            )
+            self._conn.execute(
+                'UPDATE queries SET downloaded = downloaded + 1, updated_at = ? WHERE query = ?',
+                (now, query)
+            )
+
+    def record_analyzed(self, query, image_path):
+        self._execute(
+            'UPDATE pins SET stage = ?, updated_at = ? WHERE query = ? AND image_path = ?',
+            ('analyzed', time.time(), query, image_path)
+        )
+
+    def pending_analysis(self, query):
+        """
+        已下载但还没有完成分析的图片: [(保存路径, 内容sha256)]
+        """
+        return self._execute(
+            'SELECT image_path, digest FROM pins WHERE query = ? AND stage = ?',
+            (query, 'downloaded')
+        )
@@ -0,0 +1,246 @@
+"""
+图片元数据的输出: 逐图JSON文件、追加写的JSONL和按批写入的Parquet
+"""
+import os
+import json
+import time
+import logging
+import threading
+from datetime import datetime
+
+
+class JsonFileSink:
+    """
+    每张图片一个 pin_<n>.json (旧格式, 与图片放在同一目录)
+    """
+
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+
+    def write(self, record):
+        json_path = os.path.splitext(os.path.join(self.base_dir, record['image_path']))[0] + '.json'
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(record['analysis'], f, ensure_ascii=False, indent=2)
+
+    def records(self):
+        """
+        读回之前写入的记录 (只有 image_path 和 analysis): 有同名 .jpg 的 .json 文件
+        """
+        for root, _, files in os.walk(self.base_dir):
+            names = set(files)
+            for name in files:
+                stem, ext = os.path.splitext(name)
+                if ext != '.json' or stem + '.jpg' not in names:
+                    continue
+                try:
+                    with open(os.path.join(root, name), encoding='utf-8') as f:
+                        analysis = json.load(f)
+                except ValueError:
+                    continue
+                yield {
+                    'image_path': os.path.relpath(os.path.join(root, stem + '.jpg'), self.base_dir),
+                    'analysis': analysis
+                }
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class JsonlSink:
+    """
+    追加写入的JSONL文件, 每行一条记录
+
+    每条记录用一次 write 系统调用追加 (O_APPEND), 多个分片进程可以写同一个文件;
+    距上次fsync超过 fsync_interval 秒时fsync一次, 崩溃时最多丢失这段时间内的记录。
+    close() 之后再写入会重新打开文件。
+    """
+
+    def __init__(self, path, fsync_interval=5.0):
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._fd = None
+        self._last_sync = time.monotonic()
+
+    def write(self, record):
+        line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+        with self._lock:
+            if self._fd is None:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                self._fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            os.write(self._fd, line)
+            if time.monotonic() - self._last_sync >= self.fsync_interval:
+                os.fsync(self._fd)
+                self._last_sync = time.monotonic()
+
+    def records(self):
+        """
+        读回文件中的所有记录
+        """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # 崩溃时可能留下写了一半的最后一行
+                    continue
+
+    def flush(self):
+        with self._lock:
+            if self._fd is not None:
+                os.fsync(self._fd)
+                self._last_sync = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None:
+                os.fsync(self._fd)
+                os.close(self._fd)
+                self._fd = None
+
+
+class ParquetSink:
+    """
+    Parquet列式文件, 每积累 row_group_size 条记录写出一个row group (需要安装 pyarrow)
+
+    Parquet文件不能追加, 每次 close() 之前写入的记录组成一个新文件 (文件名带时间和进程号);
+    整个目录可以用 pyarrow.dataset.dataset(<目录>) 一次顺序读取。analysis列保存JSON字符串。
+    """
+
+    COLUMNS = ('query', 'image_path', 'sha256', 'description', 'analyzed_at', 'analysis')
+
+    def __init__(self, directory, row_group_size=1000):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.directory = directory
+        self.path = None
+        self.row_group_size = row_group_size
+        self._pa = pa
+        self._pq = pq
+        self._schema = pa.schema([(name, pa.string()) for name in self.COLUMNS])
+        self._writer = None
+        self._tmp_path = None
+        self._rows = []
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        row = dict(record, analysis=json.dumps(record['analysis'], ensure_ascii=False))
+        with self._lock:
+            self._rows.append(row)
+            if len(self._rows) >= self.row_group_size:
+                self._write_row_group()
+
+    def _write_row_group(self):
+        if not self._rows:
+            return
+        if self._writer is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self.path = os.path.join(
+                self.directory,
+                f"analysis-{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}-{os.getpid()}.parquet"
+            )
+            self._tmp_path = os.path.join(self.directory, f".{os.path.basename(self.path)}.part")
+            self._writer = self._pq.ParquetWriter(self._tmp_path, self._schema)
+        table = self._pa.Table.from_pylist(self._rows, schema=self._schema)
+        self._writer.write_table(table)
+        self._rows = []
+
+    def records(self):
+        """
+        读回目录中已完成的Parquet文件 (正在写的 .part 文件没有footer, 无法读取)
+        """
+        if not os.path.isdir(self.directory):
+            return
+        for name in sorted(os.listdir(self.directory)):
+            if name.startswith('.') or not name.endswith('.parquet'):
+                continue
+            # 旧文件可能缺少后来加入的列
+            table = self._pq.read_table(os.path.join(self.directory, name))
+            for row in table.to_pylist():
+                yield dict(row, analysis=json.loads(row['analysis']))
+
+    def flush(self):
+        with self._lock:
+            self._write_row_group()
+
+    def close(self):
+        with self._lock:
+            self._write_row_group()
+            if self._writer is None:
+                return
+            self._writer.close()
+            self._writer = None
+            # 写完footer后才改名, 目录中只会出现完整的文件
+            os.replace(self._tmp_path, self.path)
+
+
+class MetadataSinks:
+    """
+    把每条分析记录写入所有已配置的sink
+    """
+
+    def __init__(self, sinks, logger=None):
+        self.sinks = list(sinks)
+        self.logger = logger or logging.getLogger(__name__)
+
+    def write(self, record):
+        for sink in self.sinks:
+            sink.write(record)
+
+    def records(self):
+        """
+        从第一个sink读回之前写入的记录 (各sink内容相同, 读一个即可)
+        """
+        if self.sinks:
+            yield from self.sinks[0].records()
+
+    def flush(self):
+        for sink in self.sinks:
+            try:
+                sink.flush()
+            except Exception as e:
+                self.logger.error(f"Failed to flush {type(sink).__name__}: {str(e)}")
+
+    def close(self):
+        for sink in self.sinks:
+            try:
+                sink.close()
+            except Exception as e:
+                self.logger.error(f"Failed to close {type(sink).__name__}: {str(e)}")
+
+
+def make_metadata_sinks(kinds, base_dir, logger=None, state_dir=None):
+    """
+    按名称创建sink: 'jsonl' -> <state_dir>/metadata.jsonl, 'parquet' -> <state_dir>/metadata/*.parquet,
+    'json' -> <base_dir> 下每张图片一个 pin_<n>.json; 未安装pyarrow时 'parquet' 回退为 'jsonl'
+    :param state_dir: 不指定时与 base_dir 相同
+    """
+    logger = logger or logging.getLogger(__name__)
+    state_dir = state_dir or base_dir
+    if isinstance(kinds, str):
+        kinds = [kinds]
+    kinds = list(dict.fromkeys(kinds or []))
+    sinks = []
+    for kind in kinds:
+        if kind == 'parquet':
+            try:
+                sinks.append(ParquetSink(os.path.join(state_dir, 'metadata')))
+                continue
+            except ImportError:
+                logger.warning('pyarrow 未安装, Parquet输出回退到 JSONL')
+                if 'jsonl' in kinds:
+                    continue
+                kind = 'jsonl'
+        if kind == 'jsonl':
+            sinks.append(JsonlSink(os.path.join(state_dir, 'metadata.jsonl')))
+        elif kind == 'json':
+            sinks.append(JsonFileSink(base_dir))
+        else:
+            raise ValueError(f"Unknown metadata sink: {kind}")
+    return MetadataSinks(sinks, logger)
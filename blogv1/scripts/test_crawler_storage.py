@@ -0,0 +1,111 @@
+import time
+
+import pytest
+
+from crawler_storage import DedupIndex, CrawlCheckpoint, normalize_pin_url
+
+
+@pytest.fixture
+def dedup(tmp_path):
+    index = DedupIndex(str(tmp_path / 'dedup.sqlite3'))
+    yield index
+    index.close()
+
+
+def test_normalize_pin_url_ignores_rendition_and_query():
+    key = 'i.pinimg.com/ab/cd/ef'
+    assert normalize_pin_url('https://i.pinimg.com/736x/ab/cd/ef.jpg?x=1') == key
+    assert normalize_pin_url('https://I.PINIMG.COM/originals/ab/cd/ef.png') == key
+    assert normalize_pin_url('https://i.pinimg.com/236x350/ab/cd/ef.webp') == key
+
+
+def test_url_content(dedup):
+    url = 'https://i.pinimg.com/736x/ab/cd/ef.jpg'
+    assert dedup.url_content(url) == (False, None)
+    dedup.add_url(url)
+    assert dedup.url_content('https://i.pinimg.com/originals/ab/cd/ef.jpg') == (True, None)
+    dedup.add_url(url, 'abc')
+    assert dedup.url_content(url) == (True, 'abc')
+
+
+def test_claim_content_once(dedup):
+    assert dedup.claim_content('abc')
+    assert not dedup.claim_content('abc')
+    dedup.set_content_path('abc', '/images/abc.jpg', 'coats')
+    assert dedup.content_path('abc') == '/images/abc.jpg'
+    assert not dedup.claim_content('abc')
+
+
+def test_release_content_allows_reclaim(dedup):
+    assert dedup.claim_content('abc')
+    dedup.release_content('abc')
+    assert dedup.content_path('abc') is None
+    assert dedup.claim_content('abc')
+
+
+def test_release_content_keeps_saved_content(dedup):
+    dedup.claim_content('abc')
+    dedup.set_content_path('abc', '/images/abc.jpg')
+    dedup.release_content('abc')
+    assert dedup.content_path('abc') == '/images/abc.jpg'
+
+
+def age_claim(dedup, sha256, seconds):
+    dedup._execute('UPDATE contents SET created_at = ? WHERE sha256 = ?', (time.time() - seconds, sha256))
+
+
+def test_stale_claim_is_reclaimed(dedup):
+    assert dedup.claim_content('abc')
+    age_claim(dedup, 'abc', DedupIndex.STALE_CLAIM_SECONDS - 60)
+    assert not dedup.claim_content('abc')
+    age_claim(dedup, 'abc', DedupIndex.STALE_CLAIM_SECONDS + 60)
+    assert dedup.claim_content('abc')
+    # 接管后重新计时
+    assert not dedup.claim_content('abc')
+
+
+def test_saved_content_is_never_reclaimed(dedup):
+    dedup.claim_content('abc')
+    dedup.set_content_path('abc', '/images/abc.jpg')
+    age_claim(dedup, 'abc', DedupIndex.STALE_CLAIM_SECONDS * 10)
+    assert not dedup.claim_content('abc')
+
+
+def test_claims_are_shared_between_connections(dedup):
+    other = DedupIndex(dedup.path)
+    try:
+        assert dedup.claim_content('abc')
+        assert not other.claim_content('abc')
+        dedup.release_content('abc')
+        assert other.claim_content('abc')
+    finally:
+        other.close()
+
+
+def test_phashes_since(dedup):
+    dedup.set_phash('a', 1)
+    since = time.time()
+    dedup.set_phash('b', 2 ** 64 - 1)
+    assert sorted(dedup.iter_phashes()) == [('a', 1), ('b', 2 ** 64 - 1)]
+    assert list(dedup.iter_phashes(since=since)) == [('b', 2 ** 64 - 1)]
+
+
+def test_checkpoint_progress(tmp_path):
+    checkpoint = CrawlCheckpoint(str(tmp_path / 'checkpoint.sqlite3'))
+    url = 'https://i.pinimg.com/736x/ab/cd/ef.jpg'
+    checkpoint.start_query('coats', resume=False)
+    checkpoint.record_download('coats', url, '/images/a.jpg', 'abc')
+    assert checkpoint.has_pin('coats', 'https://i.pinimg.com/originals/ab/cd/ef.jpg')
+    assert checkpoint.query_status('coats') == ('running', 1)
+    assert checkpoint.pending_analysis('coats') == [('/images/a.jpg', 'abc')]
+    checkpoint.record_analyzed('coats', '/images/a.jpg')
+    assert checkpoint.pending_analysis('coats') == []
+
+    checkpoint.start_query('coats', resume=True)
+    assert checkpoint.query_status('coats') == ('running', 1)
+    checkpoint.finish_query('coats')
+    assert checkpoint.query_status('coats') == ('done', 1)
+    checkpoint.start_query('coats', resume=False)
+    assert checkpoint.query_status('coats') == ('running', 0)
+    assert not checkpoint.has_pin('coats', url)
+    checkpoint.close()
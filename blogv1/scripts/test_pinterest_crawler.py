@@ -0,0 +1,310 @@
+"""
+pinterest_crawler 的离线测试: 关键词打标签、图片尺寸探测、Gemini重试、断点续爬
+
+运行: python -m pytest blogv1/scripts
+"""
+import io
+import random
+
+import pytest
+
+import benchmark_crawler as bc
+import pinterest_crawler as pc
+
+
+@pytest.fixture
+def crawler(tmp_path):
+    return bc.make_crawler(str(tmp_path), gemini_backend=pc.FakeGeminiBackend(), analysis_cache_db=None)
+
+
+# ---------- analyze_image_metadata ----------
+
+def reference_metadata(description):
+    """
+    原来的逐类别扫描: 对每个类别逐个判断 `keyword in text`
+    """
+    if '#' in description:
+        tags = [tag.strip() for tag in description.split('#')[1:]]
+        desc_text = description + ' ' + ' '.join(tags)
+    else:
+        tags, desc_text = [], description
+    desc_lower = desc_text.lower()
+
+    def first(table):
+        return next((label for label, keywords in table.items()
+                     if any(keyword in desc_lower for keyword in keywords)), 'unknown')
+
+    metadata = {
+        'gender': first(pc.GENDER_KEYWORDS),
+        'age_group': first(pc.AGE_GROUP_KEYWORDS),
+        'tags': tags,
+        'keywords': [word for word in desc_text.split() if len(word) > 1],
+    }
+    for field, table in pc.TAG_KEYWORDS.items():
+        metadata[field] = [label for label, keywords in table.items()
+                           if any(keyword in desc_lower for keyword in keywords)]
+
+    scores = dict.fromkeys(pc.SCORE_NAMES, 8.0)
+    for name, field, step in (('fashion', 'styles', 0.5), ('creativity', 'styling_tips', 0.5),
+                              ('occasion_fit', 'occasions', 0.5), ('practicality', 'clothing_types', 0.3)):
+        if metadata[field]:
+            scores[name] = round(7.0 + len(metadata[field]) * step, 1)
+    scores['overall'] = round(
+        (scores['fashion'] + scores['creativity'] + scores['occasion_fit'] + scores['practicality']) / 4, 1
+    )
+    metadata['scores'] = scores
+    return metadata
+
+
+def sample_descriptions(count, seed=0):
+    """
+    由关键词表中的词随机拼成的描述, 包括大小写混合、#标签和不带空格的连写 (重叠/嵌套的关键词)
+    """
+    rnd = random.Random(seed)
+    words = [
+        keyword
+        for table in (pc.GENDER_KEYWORDS, pc.AGE_GROUP_KEYWORDS, *pc.TAG_KEYWORDS.values())
+        for keywords in table.values()
+        for keyword in keywords
+    ] + ['the', 'outfit', 'look', 'with', 'and', 'ideas', 'womenswear', 'theme']
+    descriptions = [
+        '',
+        'Young adult WOMEN in a cozy fall coat #streetstyle #Korean',
+        'K-Fashion Seoul look: oversized blazer, wide-leg jeans and chunky sneakers',
+        'his and hers matching outfits',
+    ]
+    for _ in range(count):
+        parts = [rnd.choice(words) for _ in range(rnd.randint(1, 12))]
+        if rnd.random() < 0.3:
+            parts = [rnd.choice(['', ' ', '-']).join(parts)]
+        text = ' '.join(word.upper() if rnd.random() < 0.2 else word for word in parts)
+        if rnd.random() < 0.3:
+            text += ' #' + ' #'.join(rnd.choice(words) for _ in range(2))
+        descriptions.append(text)
+    return descriptions
+
+
+def test_analyze_image_metadata_matches_per_category_scan(crawler):
+    for description in sample_descriptions(500):
+        metadata = crawler.analyze_image_metadata(description)
+        expected = reference_metadata(description)
+        assert {key: metadata[key] for key in expected} == expected, description
+        assert metadata['raw_description'] == description
+
+
+def test_analyze_metadata_batch_matches_single(crawler):
+    descriptions = sample_descriptions(200, seed=1)
+    batch = crawler.analyze_metadata_batch(descriptions, with_dicts=True)
+    assert len(batch) == len(descriptions)
+    single_codes = {field: batch.single_value_codes(field) for field in ('gender', 'age_group')}
+    for i, description in enumerate(descriptions):
+        metadata = crawler.analyze_image_metadata(description)
+        assert batch.dicts[i] == metadata
+        assert batch.scores[i].tolist() == pytest.approx([metadata['scores'][name] for name in pc.SCORE_NAMES])
+        for field, (labels, codes) in single_codes.items():
+            assert (labels[codes[i]] if codes[i] >= 0 else 'unknown') == metadata[field]
+        for field in pc.TAG_KEYWORDS:
+            labels, matrix = batch.field_matrix(field)
+            assert [label for label, hit in zip(labels, matrix[i]) if hit] == metadata[field]
+
+
+# ---------- probe_image_size ----------
+
+def encode(fmt, size=(321, 123), mode='RGB', **params):
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new(mode, size, (200, 30, 90) if mode == 'RGB' else (200, 30, 90, 128)).save(buffer, fmt, **params)
+    return buffer.getvalue()
+
+
+def exif_bytes():
+    from PIL import Image
+
+    exif = Image.Exif()
+    exif[0x010F] = 'camera maker ' * 50
+    return exif.tobytes()
+
+
+@pytest.mark.parametrize('data, expected', [
+    (encode('JPEG'), ('JPEG', 321, 123)),
+    (encode('JPEG', progressive=True), ('JPEG', 321, 123)),
+    (encode('JPEG', exif=exif_bytes()), ('JPEG', 321, 123)),
+    (encode('PNG'), ('PNG', 321, 123)),
+], ids=['jpeg', 'progressive-jpeg', 'jpeg-exif', 'png'])
+def test_probe_image_size(data, expected):
+    assert pc.probe_image_size(data) == expected
+    assert pc.probe_image_size(data[:pc.PROBE_CHUNK_SIZE]) == expected
+
+
+@pytest.mark.parametrize('chunk, params', [
+    (b'VP8 ', {'quality': 80}),
+    (b'VP8L', {'lossless': True}),
+    (b'VP8X', {'mode': 'RGBA', 'quality': 80}),
+], ids=['lossy', 'lossless', 'extended'])
+def test_probe_image_size_webp(chunk, params):
+    data = encode('WEBP', **params)
+    assert data[12:16] == chunk
+    assert pc.probe_image_size(data[:64]) == ('WEBP', 321, 123)
+
+
+def test_probe_image_size_progressive_jpeg_is_sof2():
+    data = encode('JPEG', progressive=True)
+    assert b'\xff\xc2' in data and b'\xff\xc0' not in data
+
+
+def test_probe_image_size_rejects_unknown_or_truncated():
+    png = encode('PNG')
+    assert pc.probe_image_size(b'GIF89a' + b'\x00' * 32) is None
+    assert pc.probe_image_size(b'') is None
+    assert pc.probe_image_size(png[:20]) is None
+    assert pc.probe_image_size(encode('JPEG', exif=exif_bytes())[:64]) is None
+    assert pc.probe_image_size(b'\xff\xd8\x00\x00\x00\x00') is None
+
+
+# ---------- Gemini 重试 ----------
+
+class FlakyBackend(pc.FakeGeminiBackend):
+    """
+    先依次抛出 errors 中的错误, 之后正常返回
+    """
+
+    def __init__(self, errors):
+        super().__init__()
+        self.errors = list(errors)
+
+    def generate_content(self, contents):
+        if self.errors:
+            with self._lock:
+                self.calls += 1
+            raise self.errors.pop(0)
+        return super().generate_content(contents)
+
+
+class HttpError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f'HTTP {status_code}')
+        self.response = type('Response', (), {'status_code': status_code})()
+
+
+@pytest.mark.parametrize('error, retryable', [
+    (pc.FakeGeminiError(429, 'rate limited'), True),
+    (pc.FakeGeminiError(503, 'unavailable'), True),
+    (pc.FakeGeminiError(500, 'internal'), True),
+    (pc.FakeGeminiError(400, 'bad request'), False),
+    (pc.FakeGeminiError(403, 'forbidden'), False),
+    (HttpError(404), False),
+    (HttpError(429), True),
+    (ConnectionError('reset'), True),
+    (TimeoutError(), True),
+])
+def test_is_retryable_error(error, retryable):
+    assert pc.is_retryable_error(error) is retryable
+
+
+def test_is_retryable_error_ignores_grpc_code_method():
+    class GrpcError(Exception):
+        def code(self):
+            return 'INVALID_ARGUMENT'
+
+    assert pc.is_retryable_error(GrpcError())
+
+
+def test_backoff_delay_is_capped_full_jitter():
+    random.seed(0)
+    for attempt in range(10):
+        limit = min(60.0, 2 ** attempt)
+        delays = [pc.backoff_delay(attempt) for _ in range(200)]
+        assert all(0 <= delay < limit for delay in delays)
+        assert max(delays) > limit / 2
+    assert all(pc.backoff_delay(3, base=0.5, cap=2.0) < 2.0 for _ in range(100))
+
+
+@pytest.fixture
+def image_file(tmp_path):
+    path = tmp_path / 'pin_0.jpg'
+    path.write_bytes(encode('JPEG', size=(900, 1200)))
+    return str(path)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """
+    记录退避等待的次数, 不真的等待
+    """
+    delays = []
+    monkeypatch.setattr(pc, 'backoff_delay', lambda attempt: delays.append(attempt) or 0)
+    return delays
+
+
+def test_gemini_retries_transient_errors(crawler, image_file, sleeps):
+    crawler.gemini = pc.GeminiAnalyzer(backend=FlakyBackend([
+        pc.FakeGeminiError(429, 'rate limited'), pc.FakeGeminiError(503, 'unavailable')
+    ]))
+    analysis = crawler.analyze_image_with_gemini(image_file)
+    assert analysis is not None and 'outfit_analysis' in analysis
+    assert crawler.gemini.model.calls == 3
+    assert sleeps == [0, 1]
+    counters = crawler.metrics.snapshot()['counters']
+    assert counters['gemini_errors'] == 2 and counters['gemini_retries'] == 2
+
+
+def test_gemini_does_not_retry_client_errors(crawler, image_file, sleeps):
+    crawler.gemini = pc.GeminiAnalyzer(backend=FlakyBackend([pc.FakeGeminiError(400, 'bad request')]))
+    assert crawler.analyze_image_with_gemini(image_file) is None
+    assert crawler.gemini.model.calls == 1
+    assert sleeps == []
+
+
+def test_gemini_gives_up_after_max_retries(crawler, image_file, sleeps):
+    crawler.gemini = pc.GeminiAnalyzer(backend=pc.FakeGeminiBackend(failure_rate=1.0))
+    crawler.gemini_max_retries = 3
+    assert crawler.analyze_image_with_gemini(image_file) is None
+    assert crawler.gemini.model.calls == 3
+    assert sleeps == [0, 1, 2]
+
+
+# ---------- 断点续爬 ----------
+
+def test_resume_after_partial_run(tmp_path, sleeps):
+    corpus = bc.make_corpus(30, seed=3)
+    base_dir = str(tmp_path)
+    with bc.CorpusServer(corpus) as server:
+        # 第一次运行: 页面上只有8个pin (不够max_images), 分析全部失败 -> 查询未完成, 图片等待分析
+        failing = FlakyBackend([pc.FakeGeminiError(400, 'bad request')] * 100)
+        first = bc.make_crawler(base_dir, gemini_backend=failing, download_workers=2, analysis_workers=1)
+        first.driver = bc.FakeDriver(corpus[:8], server.base_url, per_scroll=4)
+        first.search_and_download('street style', max_images=20)
+        status, downloaded = first.checkpoint.query_status('street style')
+        pending = first.checkpoint.pending_analysis('street style')
+        assert status == 'running' and 0 < downloaded < 8
+        assert len(pending) == downloaded
+        first_images = first.image_store.images('street style')
+        assert len(first_images) == downloaded
+
+        # 重新启动后续爬: 先分析上次留下的图片, 已下载的pin不再下载, 只补足剩下的数量
+        backend = pc.FakeGeminiBackend()
+        second = bc.make_crawler(base_dir, gemini_backend=backend, download_workers=2, analysis_workers=1)
+        second.driver = bc.FakeDriver(corpus, server.base_url, per_scroll=10)
+        assert second.search_and_download('street style', max_images=downloaded + 5, resume=True)
+
+    assert second.checkpoint.query_status('street style') == ('done', downloaded + 5)
+    assert second.checkpoint.pending_analysis('street style') == []
+    counters = second.metrics.snapshot()['counters']
+    assert counters['downloaded'] == 5
+    assert counters['analyzed'] == downloaded + 5
+    assert backend.calls == downloaded + 5
+    images = second.image_store.images('street style')
+    assert images[:downloaded] == first_images and len(set(images)) == downloaded + 5
+    assert len(second.tag_index) == downloaded + 5
+
+
+def test_without_resume_checkpoint_starts_over(tmp_path):
+    corpus = bc.make_corpus(12, seed=4)
+    with bc.CorpusServer(corpus) as server:
+        crawler = bc.make_crawler(str(tmp_path), gemini_backend=pc.FakeGeminiBackend(), dedup_db=None)
+        crawler.driver = bc.FakeDriver(corpus, server.base_url)
+        crawler.search_and_download('coats', max_images=3)
+        assert crawler.checkpoint.query_status('coats') == ('done', 3)
+        crawler.search_and_download('coats', max_images=2)
+        assert crawler.checkpoint.query_status('coats') == ('done', 2)
@@ -0,0 +1,112 @@
+import pytest
+
+from tag_index import TagIndex, pin_tags, normalize_tag
+
+
+def gemini_analysis(items, colors, style='casual', overall=None, seasons=('autumn',)):
+    analysis = {
+        'outfit_analysis': {'clothing_items': list(items), 'colors': list(colors), 'style_category': style},
+        'style_elements': {'silhouette': 'straight'},
+        'styling_notes': {'occasions': ['daily'], 'seasons': list(seasons)},
+        'fashion_scores': {},
+    }
+    if overall is not None:
+        analysis['fashion_scores']['overall_style'] = overall
+    return analysis
+
+
+@pytest.fixture
+def index():
+    index = TagIndex()
+    index.add('a.jpg', gemini_analysis(['coat'], ['Navy Blue'], 'korean', 9, ['winter']))
+    index.add('b.jpg', gemini_analysis(['dress'], ['red'], 'korean', 7))
+    index.add('c.jpg', gemini_analysis(['coat', 'jeans'], ['black'], 'formal', 8, ['winter']))
+    index.add('d.jpg', gemini_analysis(['skirt'], ['navy blue'], 'casual', None, ['winter']))
+    index.add('e.jpg', {'styles': ['korean'], 'seasons': ['winter'], 'gender': 'female', 'age_group': 'unknown',
+                        'scores': {'overall': 8.4, 'fashion': 9.0}})
+    return index
+
+
+def keys(results):
+    return [key for key, _ in results]
+
+
+def test_normalize_tag():
+    assert normalize_tag(' Navy Blue ') == 'navy_blue'
+    assert normalize_tag('Smart-Casual') == 'smart_casual'
+
+
+def test_pin_tags_from_gemini_analysis():
+    tags, scores = pin_tags(gemini_analysis(['Wide-Leg Jeans'], ['Navy Blue'], overall='8'))
+    assert {'clothing_types:wide_leg_jeans', 'colors:navy_blue', 'styles:casual',
+            'silhouette:straight', 'occasions:daily', 'seasons:autumn'} == tags
+    assert scores == {'overall': 8.0}
+
+
+def test_pin_tags_from_keyword_metadata():
+    tags, scores = pin_tags({'gender': 'female', 'age_group': 'unknown', 'styles': ['korean', 'vintage'],
+                             'colors': [], 'scores': {'overall': 7.5, 'fashion': 'n/a'}})
+    assert tags == {'gender:female', 'styles:korean', 'styles:vintage'}
+    assert scores == {'overall': 7.5}
+
+
+def test_add_is_idempotent_per_key(index):
+    assert not index.add('a.jpg', gemini_analysis(['boots'], ['white']))
+    assert len(index) == 5 and 'a.jpg' in index
+    assert index.posting('clothing_types:boots') == []
+    assert index.add_records([{'image_path': 'a.jpg', 'analysis': {}}, {'image_path': 'f.jpg'}]) == 1
+    assert len(index) == 6
+
+
+def test_tags_and_posting(index):
+    assert index.tags()['seasons:winter'] == 4
+    assert index.posting('colors:navy_blue') == ['a.jpg', 'd.jpg']
+
+
+@pytest.mark.parametrize('expression, expected', [
+    ('korean', ['a.jpg', 'b.jpg', 'e.jpg']),
+    ('korean winter', ['a.jpg', 'e.jpg']),
+    ('korean AND winter', ['a.jpg', 'e.jpg']),
+    ('korean and winter and not coat', ['e.jpg']),
+    ('dress OR skirt', ['b.jpg', 'd.jpg']),
+    ('NOT winter', ['b.jpg']),
+    ('NOT NOT dress', ['b.jpg']),
+    ('dress OR korean winter', ['a.jpg', 'b.jpg', 'e.jpg']),
+    ('(dress OR korean) winter', ['a.jpg', 'e.jpg']),
+    ('winter AND NOT (coat OR korean)', ['d.jpg']),
+    ('"navy blue"', ['a.jpg', 'd.jpg']),
+    ('"Colors:Navy Blue"', ['a.jpg', 'd.jpg']),
+    ('Styles:KOREAN', ['a.jpg', 'b.jpg', 'e.jpg']),
+    ('clothing_types:coat', ['a.jpg', 'c.jpg']),
+    ('styles:coat', []),
+    ('unknown_tag', []),
+    ('', ['a.jpg', 'b.jpg', 'c.jpg', 'd.jpg', 'e.jpg']),
+])
+def test_search_expressions(index, expression, expected):
+    assert keys(index.search(expression)) == expected
+    assert index.count(expression) == len(expected)
+
+
+@pytest.mark.parametrize('expression', [
+    'AND korean', 'korean OR', 'korean AND', 'NOT', '(korean', 'korean )', '()', 'korean (OR winter)',
+])
+def test_invalid_expressions(index, expression):
+    with pytest.raises(ValueError):
+        index.search(expression)
+
+
+def test_score_ranges(index):
+    assert keys(index.search(score_ranges={'overall': (8, None)})) == ['a.jpg', 'c.jpg', 'e.jpg']
+    assert keys(index.search('winter', {'overall': (None, 8.5)})) == ['c.jpg', 'e.jpg']
+    # 没有该评分的pin不匹配
+    assert keys(index.search(score_ranges={'overall': (None, None)})) == ['a.jpg', 'b.jpg', 'c.jpg', 'e.jpg']
+    assert index.search(score_ranges={'coordination': (0, 10)}) == []
+
+
+def test_top_k(index):
+    assert index.search('winter', top_k=2) == [('a.jpg', 9.0), ('e.jpg', pytest.approx(8.4))]
+    # 没有评分的排在最后
+    assert keys(index.search('winter', top_k=10)) == ['a.jpg', 'e.jpg', 'c.jpg', 'd.jpg']
+    assert index.search('winter', top_k=0) == []
+    assert index.search('skirt', top_k=1) == [('d.jpg', None)]
+    assert keys(index.search(top_k=2, sort_by='fashion')) == ['e.jpg', 'a.jpg']